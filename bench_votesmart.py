@@ -0,0 +1,528 @@
+""" Benchmarks for python-votesmart.
+
+    python bench_votesmart.py memory [count]
+
+    Compares the memory held by result objects built the pre-0.4 way (one
+    ``__dict__`` per instance) with the slotted models, with and without an
+    ``IdentityMap`` sharing repeated strings.
+
+    python bench_votesmart.py construct [--size N] [--history FILE]
+
+    Times decoding and object construction (``_result_to_obj``,
+    ``BillDetail``, ``Election``, ``Address``) without any network.
+
+    python bench_votesmart.py decode [--size N] [--cassette FILE]
+                                     [--history FILE]
+
+    Compares the available JSON decoders (``votesmart.decoders``) on the
+    fixture payloads, or on the responses recorded in a ``Cassette``.
+
+    python bench_votesmart.py api [--calls N] [--size N] [--workers N]
+                                  [--history FILE]
+
+    Replays fixture payloads for every namespace from a local stand-in API
+    server and measures throughput, latency and peak memory of the sync,
+    threaded and async clients.
+
+    With ``--history`` the results are appended to a JSON lines file and
+    compared with the previous run recorded there; the exit status is 1 when
+    anything is more than ``--threshold`` (default 10%) worse.
+"""
+
+import BaseHTTPServer
+import json
+import optparse
+import os
+import resource
+import SocketServer
+import subprocess
+import sys
+import threading
+import time
+
+import votesmart
+from votesmart import (votesmart as api, _decode_response, _result_to_obj,
+                       Address, AsyncVotesmart, BillDetail, Cassette,
+                       Election, Vote, decoders)
+
+
+class DictVote(object):
+    """ Vote as built before 0.4, sharing the decoded JSON dict. """
+
+    def __init__(self, d):
+        self.__dict__ = d
+
+
+def vote_rows(count):
+    parties = ('Democratic', 'Republican', 'Independent')
+    actions = ('Yea', 'Nay', 'Not Voting')
+    for i in xrange(count):
+        # fresh strings per row, as decoded from a response
+        yield {'candidateId': str(10000 + i % 535),
+               'candidateName': 'Member, %d' % (i % 535),
+               'officeParties': parties[i % 3],
+               'action': actions[i % 3]}
+
+
+def current_rss():
+    """ Resident set size of this process in bytes. """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def peak_rss():
+    """ Highest resident set size of this process so far, in bytes. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on OS X
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure_build(kind, count):
+    if kind == 'interned':
+        identities = votesmart.IdentityMap()
+        build = lambda row: identities.get(votesmart.Vote, row)
+    else:
+        build = {'dict': DictVote, 'slots': votesmart.Vote}[kind]
+    before = current_rss()
+    objects = [build(row) for row in vote_rows(count)]
+    after = current_rss()
+    return (after - before) / float(len(objects))
+
+
+def instance_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def bench_memory(count):
+    row = next(vote_rows(1))
+    print 'per-instance size (object + attribute storage):'
+    print '  %-8s %6d bytes' % ('dict', instance_size(DictVote(dict(row))))
+    print '  %-8s %6d bytes' % ('slots', instance_size(votesmart.Vote(row)))
+    print 'resident memory per Vote, %d objects:' % count
+    for kind in ('dict', 'slots', 'interned'):
+        # a fresh interpreter per variant so freed arenas don't skew results
+        out = subprocess.check_output([sys.executable, __file__, '_build',
+                                       kind, str(count)])
+        print '  %-8s %6.1f bytes' % (kind, float(out))
+
+
+# fixture payloads, shaped like the API's responses
+
+def candidate_rows(size):
+    return [{'candidateId': str(20000 + i), 'firstName': 'First%d' % i,
+             'lastName': 'Last%d' % i, 'title': 'Representative',
+             'officeParties': ('Democratic', 'Republican')[i % 2],
+             'officeStatus': 'active', 'officeStateId': 'NC',
+             'officeDistrictName': str(i % 13 + 1)} for i in xrange(size)]
+
+
+def address_item(i):
+    return {'address': {'street': '%d Main St' % i, 'city': 'Raleigh',
+                        'state': 'NC', 'zip': '27601'},
+            'phone': {'phone1': '919-555-%04d' % i, 'fax1': ''},
+            'notes': {'notes': ''}}
+
+
+def election_item(i):
+    return {'electionId': str(600 + i), 'name': 'Election %d' % i,
+            'stateId': 'NC', 'officeTypeId': 'G', 'special': 'f',
+            'electionYear': '2008',
+            'stage': [{'stageId': stage, 'name': name, 'stateId': 'NC',
+                       'electionDate': '2008-%02d-04' % (5 + 6 * j)}
+                      for j, (stage, name) in enumerate((('P', 'Primary'),
+                                                         ('G', 'General')))]}
+
+
+def bill_item(size):
+    return {'billId': '8528', 'billNumber': 'HR 7321', 'parentBillId': '',
+            'type': 'Bill', 'title': 'Auto Industry Financing',
+            'officialTitle': 'Auto Industry Financing and Restructuring Act',
+            'billTextUrl': '', 'dateIntroduced': '2008-12-10', 'stateId': 'NA',
+            'sponsors': {'sponsor': [{'candidateId': str(20000 + i),
+                                      'name': 'Last%d, First' % i,
+                                      'type': 'Sponsor'}
+                                     for i in xrange(min(size, 50))]},
+            'actions': {'action': [{'actionId': str(23000 + i),
+                                    'stage': 'Passage', 'level': 'House',
+                                    'outcome': 'Passed',
+                                    'statusDate': '2008-12-10'}
+                                   for i in xrange(min(size, 20))]},
+            'amendments': ''}
+
+
+def fixtures(size):
+    """ {API function: payload} covering every namespace. """
+    items = lambda fn: [fn(i) for i in xrange(size)]
+    return {
+        'Address.getOffice': {'address': {'office': items(address_item)}},
+        'CandidateBio.getBio': {'bio': {'candidate': {
+            'candidateId': '26732', 'firstName': 'Nancy',
+            'lastName': 'Pelosi', 'birthDate': '03/26/1940'}}},
+        'Candidates.getByOfficeState': {'candidateList': {
+            'candidate': candidate_rows(size)}},
+        'Committee.getCommitteesByTypeState': {'committees': {'committee':
+            items(lambda i: {'committeeId': str(i), 'parentId': '',
+                             'stateId': 'NC', 'committeeTypeId': 'H',
+                             'name': 'Committee %d' % i})}},
+        'District.getByOfficeState': {'districtList': {'district':
+            items(lambda i: {'districtId': str(i), 'name': str(i + 1),
+                             'officeId': '5', 'stateId': 'NC'})}},
+        'Election.getElectionByYearState': {'elections': {'election':
+            items(election_item)}},
+        'Leadership.getPositions': {'leadership': {'position':
+            items(lambda i: {'leadershipId': str(i), 'name': 'Whip %d' % i,
+                             'officeId': '5', 'officeName': 'U.S. House'})}},
+        'Local.getCounties': {'counties': {'county':
+            items(lambda i: {'localId': str(i), 'name': 'County %d' % i,
+                             'url': ''})}},
+        'Measure.getMeasuresByYearState': {'measures': {'measure':
+            items(lambda i: {'measureId': str(i), 'measureCode': str(i),
+                             'title': 'Measure %d' % i, 'outcome': 'Pass'})}},
+        'Npat.getNpat': {'npat': {'candidateId': '26732',
+                                  'surveyMessage': 'Declined'}},
+        'Office.getOfficesByType': {'offices': {'office':
+            items(lambda i: {'officeId': str(i), 'name': 'Office %d' % i,
+                             'officeTypeId': 'C', 'officeLevelId': 'F',
+                             'officeBranchId': 'L'})}},
+        'Officials.getByOfficeState': {'candidateList': {
+            'candidate': candidate_rows(size)}},
+        'Rating.getCandidateRating': {'candidateRating': {'rating':
+            items(lambda i: {'sigId': str(i), 'ratingId': str(i),
+                             'timespan': '2008', 'rating': str(i % 100),
+                             'ratingText': ''})}},
+        'State.getStateIDs': {'stateList': {'list': {'state':
+            items(lambda i: {'stateId': 'S%d' % i, 'name': 'State %d' % i})}}},
+        'Votes.getBill': {'bill': bill_item(size)},
+        'Votes.getBillActionVotes': {'votes': {'vote':
+            list(vote_rows(size))}},
+    }
+
+
+# one call of each fixture through the public client, i varies the arguments
+WORKLOAD = [
+    ('address', 'getOffice', lambda i: (str(i),)),
+    ('candidatebio', 'getBio', lambda i: (str(i),)),
+    ('candidates', 'getByOfficeState', lambda i: ('5', 'NC', str(i))),
+    ('committee', 'getCommitteesByTypeState', lambda i: ('H', str(i))),
+    ('district', 'getByOfficeState', lambda i: ('5', 'NC', str(i))),
+    ('election', 'getElectionByYearState', lambda i: (i, 'NC')),
+    ('leadership', 'getPositions', lambda i: ('NC', str(i))),
+    ('local', 'getCounties', lambda i: (str(i),)),
+    ('measure', 'getMeasuresByYearState', lambda i: (i, 'NC')),
+    ('npat', 'getNpat', lambda i: (str(i),)),
+    ('office', 'getOfficesByType', lambda i: (str(i),)),
+    ('officials', 'getByOfficeState', lambda i: ('5', str(i))),
+    ('rating', 'getCandidateRating', lambda i: (str(i),)),
+    ('state', 'getStateIDs', lambda i: ()),
+    ('votes', 'getBill', lambda i: (str(i),)),
+    ('votes', 'getBillActionVotes', lambda i: (str(i),)),
+]
+
+
+class ReplayHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers each API function with its pre-encoded fixture. """
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body in one segment, or delayed ACKs dominate the timings
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        func = self.path.partition('?')[0].lstrip('/')
+        body = self.server.bodies.get(func)
+        status = 200 if body is not None else 404
+        body = body or '{}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ReplayServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Local stand-in for the Vote Smart API on a free port. """
+
+    daemon_threads = True
+
+    def __init__(self, payloads):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           ReplayHandler)
+        self.bodies = dict((func, json.dumps(payload))
+                           for func, payload in payloads.iteritems())
+        self.thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s/' % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def latency_summary(latencies, elapsed):
+    latencies = sorted(latencies)
+    pick = lambda q: latencies[min(int(q * len(latencies)),
+                                   len(latencies) - 1)] * 1000
+    return {'calls': len(latencies),
+            'calls_per_sec': len(latencies) / elapsed,
+            'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99)}
+
+
+def timed_call(ns, method, args, latencies):
+    start = time.time()
+    getattr(getattr(api, ns), method)(*args)
+    latencies.append(time.time() - start)
+
+
+def calls(count):
+    for i in xrange(count):
+        ns, method, args = WORKLOAD[i % len(WORKLOAD)]
+        yield ns, method, args(i)
+
+
+def run_sync(count, workers):
+    latencies = []
+    for ns, method, args in calls(count):
+        timed_call(ns, method, args, latencies)
+    return latencies
+
+
+def run_threaded(count, workers):
+    latencies = []
+    work = list(calls(count))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not work:
+                    return
+                ns, method, args = work.pop()
+            timed_call(ns, method, args, latencies)
+
+    threads = [threading.Thread(target=worker) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies
+
+
+def run_async(count, workers):
+    client = AsyncVotesmart(concurrency=workers)
+    latencies = []
+    futures = []
+    for ns, method, args in calls(count):
+        # includes the time spent queued behind the concurrency limit
+        start = time.time()
+        future = getattr(getattr(client, ns), method)(*args)
+        future.add_done_callback(
+            lambda f, start=start: latencies.append(time.time() - start))
+        futures.append(future)
+    client.gather(futures)
+    client.close()
+    return latencies
+
+
+WORKLOADS = [('sync', run_sync), ('threaded', run_threaded),
+             ('async', run_async)]
+
+
+def measure_api(workload, count, size, workers):
+    """ Run one workload against a replay server, in this process. """
+    server = ReplayServer(fixtures(size))
+    api.apikey = 'bench'
+    api.base_url = server.url
+    try:
+        run = dict(WORKLOADS)[workload]
+        run(len(WORKLOAD), workers)      # warm up connections
+        start = time.time()
+        latencies = run(count, workers)
+        result = latency_summary(latencies, time.time() - start)
+    finally:
+        server.stop()
+    result['peak_rss_mb'] = peak_rss() / 1048576.0
+    return result
+
+
+def best_rate(fn, repeat=5, minimum=0.2):
+    """ Best calls per second of ``fn`` over ``repeat`` timed runs. """
+    rates = []
+    for r in range(repeat):
+        n = 0
+        start = time.time()
+        while True:
+            fn()
+            n += 1
+            elapsed = time.time() - start
+            if elapsed >= minimum:
+                break
+        rates.append(n / elapsed)
+    return max(rates)
+
+
+def bench_construct(size):
+    payloads = fixtures(size)
+    bodies = dict((func, json.dumps(payload))
+                  for func, payload in payloads.iteritems())
+    votes = payloads['Votes.getBillActionVotes']['votes']['vote']
+    bill = payloads['Votes.getBill']['bill']
+    elections = payloads['Election.getElectionByYearState']['elections']
+    addresses = payloads['Address.getOffice']['address']['office']
+    cases = [
+        ('decode votes', lambda: _decode_response(
+            bodies['Votes.getBillActionVotes'])),
+        ('_result_to_obj votes', lambda: _result_to_obj(Vote, votes)),
+        ('BillDetail', lambda: BillDetail(bill)),
+        ('Election list', lambda: _result_to_obj(Election,
+                                                 elections['election'])),
+        ('Address list', lambda: _result_to_obj(Address, addresses)),
+    ]
+    results = {}
+    for name, fn in cases:
+        results[name] = {'calls_per_sec': best_rate(fn)}
+        print '  %-24s %10.1f calls/s' % (name, results[name]['calls_per_sec'])
+    return results
+
+
+def bench_decode(size, cassette=None):
+    if cassette:
+        bodies = [body for key, body in Cassette(cassette).items()]
+    else:
+        bodies = [json.dumps(payload) for payload in fixtures(size).values()]
+    total = sum(len(body) for body in bodies) / 1048576.0
+    results = {}
+    for name, loads in sorted(decoders.iteritems()):
+        if name == 'fastest':
+            continue
+        rate = best_rate(lambda: [loads(body) for body in bodies])
+        results[name] = {'mb_per_sec': rate * total}
+        print '  %-12s %8.1f MB/s' % (name, results[name]['mb_per_sec'])
+    return results
+
+
+def bench_api(count, size, workers):
+    results = {}
+    for name, run in WORKLOADS:
+        # each workload in a fresh interpreter so peak memory is its own
+        out = subprocess.check_output([sys.executable, __file__, '_api', name,
+                                       str(count), str(size), str(workers)])
+        results[name] = r = json.loads(out)
+        print ('  %-9s %8.1f calls/s  p50 %6.2f ms  p95 %6.2f ms  '
+               'p99 %6.2f ms  peak %6.1f MB' % (name, r['calls_per_sec'],
+               r['p50_ms'], r['p95_ms'], r['p99_ms'], r['peak_rss_mb']))
+    return results
+
+
+# lower is better for these metrics, higher for the rest
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb')
+
+
+def regressions(previous, current, threshold):
+    """ (case, metric, before, after) for metrics worse than ``threshold``. """
+    worse = []
+    for case, metrics in sorted(current.iteritems()):
+        for metric, after in sorted(metrics.iteritems()):
+            before = previous.get(case, {}).get(metric)
+            if not before:
+                continue
+            change = (after - before) / float(before)
+            if metric not in LOWER_IS_BETTER:
+                change = -change
+            if change > threshold:
+                worse.append((case, metric, before, after))
+    return worse
+
+
+def revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def record(path, suite, options, results, threshold):
+    """ Append ``results`` to the history file, report regressions. """
+    previous = None
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if (entry['suite'], entry['options']) == (suite, options):
+                    previous = entry
+    with open(path, 'a') as f:
+        f.write(json.dumps({'suite': suite, 'options': options,
+                            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                            'revision': revision(),
+                            'python': sys.version.split()[0],
+                            'results': results}, sort_keys=True) + '\n')
+    if previous is None:
+        return 0
+    worse = regressions(previous['results'], results, threshold)
+    print 'compared with %s (%s):' % (previous['revision'], previous['time'])
+    for case, metric, before, after in worse:
+        print '  REGRESSION %s %s: %.2f -> %.2f' % (case, metric, before, after)
+    if not worse:
+        print '  no regressions'
+    return 1 if worse else 0
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage=__doc__.rstrip())
+    parser.add_option('--calls', type='int', default=2000)
+    parser.add_option('--size', type='int', default=100,
+                      help='items per list in the fixture payloads')
+    parser.add_option('--workers', type='int', default=8)
+    parser.add_option('--cassette', help='decode the responses recorded here')
+    parser.add_option('--history', help='JSON lines file of past results')
+    parser.add_option('--threshold', type='float', default=0.1)
+    options, args = parser.parse_args(argv[1:])
+    if args[:1] == ['_build']:
+        print measure_build(args[1], int(args[2]))
+    elif args[:1] == ['_api']:
+        print json.dumps(measure_api(args[1], *map(int, args[2:5])))
+    elif args[:1] == ['memory']:
+        bench_memory(int(args[1]) if len(args) > 1 else 500000)
+    elif args[:1] in (['construct'], ['decode'], ['api']):
+        suite = args[0]
+        if suite == 'construct':
+            settings = {'size': options.size}
+            print 'construction, %d items per list:' % options.size
+            results = bench_construct(options.size)
+        elif suite == 'decode':
+            settings = {'size': options.size, 'cassette': options.cassette}
+            print 'decoding %s:' % (options.cassette or
+                                    'fixtures, %d items per list' % options.size)
+            results = bench_decode(options.size, options.cassette)
+        else:
+            settings = {'calls': options.calls, 'size': options.size,
+                        'workers': options.workers}
+            print ('%d calls over %d endpoints, %d items per list, %d workers:'
+                   % (options.calls, len(WORKLOAD), options.size,
+                      options.workers))
+            results = bench_api(options.calls, options.size, options.workers)
+        if options.history:
+            return record(options.history, suite, settings, results,
+                          options.threshold)
+    else:
+        parser.print_usage()
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
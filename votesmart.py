@@ -10,76 +10,1190 @@ __version__ = "0.3.4"
 __copyright__ = "Copyright (c) 2016 Project Vote Smart"
 __license__ = "BSD"
 
-import urllib, urllib2
+import array
+import base64
+import BaseHTTPServer
+import csv
+import hashlib
+import httplib
+import logging
+import mmap
+import multiprocessing
+import optparse
+import os
+import Queue
+import random
+import re
+import socket
+import SocketServer
+import sqlite3
+import StringIO
+import struct
+import sys
+import threading
+import time
+import urllib
+import urlparse
+import zlib
+from collections import Mapping, OrderedDict, Sequence
 try:
     import json
 except ImportError:
     import simplejson as json
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 class VotesmartApiError(Exception):
     """ Exception for Sunlight API errors """
 
-class VotesmartApiObject(object):
-    def __init__(self, d):
-        self.__dict__ = d
+class VotesmartHttpError(VotesmartApiError):
+    """ Exception for unsuccessful HTTP responses from the API """
+
+    def __init__(self, status, reason):
+        VotesmartApiError.__init__(self, 'HTTP Error %s: %s' % (status, reason))
+        self.status = status
+
+class VotesmartResponseError(VotesmartApiError):
+    """ Exception for error messages returned by the API, e.g. no data """
+
+class CircuitOpenError(VotesmartApiError):
+    """ Exception raised while the circuit breaker refuses calls """
+
+class TransportResponse(object):
+    """ Status, headers and body of a single HTTP response. """
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+class _Inflater(object):
+    """ Incremental decoder of a gzip or deflate encoded body. """
+
+    def __init__(self):
+        # +32 accepts both gzip and zlib headers
+        self._obj = zlib.decompressobj(zlib.MAX_WBITS | 32)
+        self._started = False
+
+    def decompress(self, data):
+        if not self._started and data:
+            self._started = True
+            try:
+                return self._obj.decompress(data)
+            except zlib.error:
+                # some servers send deflate without the zlib header
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._obj.decompress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+class HttpTransport(object):
+    """ HTTP transport that keeps connections alive and pools them per host.
+
+        ``pool_size`` bounds the number of idle connections kept per host and
+        ``timeout`` is the socket timeout (in seconds) for each request.
+        With ``compress`` responses are requested gzip or deflate encoded and
+        decoded transparently.  ``proxies`` maps a scheme to the URL of the
+        proxy used for it (https through a CONNECT tunnel), by default those
+        of the ``http_proxy``/``https_proxy`` environment variables, hosts in
+        ``no_proxy`` excepted.  Redirects are followed up to
+        ``max_redirects`` times.
+        Any object with a compatible ``request(url, headers=None)`` method
+        may be assigned to ``votesmart.transport`` instead.
+    """
+
+    max_redirects = 5
+    redirect_statuses = (301, 302, 303, 307, 308)
+
+    def __init__(self, pool_size=4, timeout=30, compress=True, proxies=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.compress = compress
+        if proxies is None:
+            proxies = urllib.getproxies()
+        self.proxies = proxies
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _proxy(self, scheme, netloc):
+        """ (address, Proxy-Authorization header) of the proxy for a host,
+            None for a direct connection.
+        """
+        proxy = self.proxies.get(scheme)
+        if not proxy or urllib.proxy_bypass(netloc.rsplit(':', 1)[0]):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        auth, _, address = urlparse.urlsplit(proxy).netloc.rpartition('@')
+        if auth:
+            auth = 'Basic ' + base64.b64encode(urllib.unquote(auth))
+        return address, auth or None
+
+    def _acquire(self, key):
+        self._lock.acquire()
+        try:
+            pool = self._pools.get(key)
+            if pool:
+                return pool.pop(), True
+        finally:
+            self._lock.release()
+        scheme, netloc, proxy = key
+        if proxy is None:
+            address = netloc
+        else:
+            address, auth = proxy
+        if scheme != 'https':
+            return httplib.HTTPConnection(address, timeout=self.timeout), False
+        conn = httplib.HTTPSConnection(address, timeout=self.timeout)
+        if proxy is not None:
+            conn.set_tunnel(netloc, headers=auth and
+                            {'Proxy-Authorization': auth} or None)
+        return conn, False
+
+    def _release(self, key, conn):
+        self._lock.acquire()
+        try:
+            pool = self._pools.setdefault(key, [])
+            if len(pool) < self.pool_size:
+                pool.append(conn)
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def close(self):
+        """ Close all idle pooled connections. """
+        self._lock.acquire()
+        try:
+            pools, self._pools = self._pools, {}
+        finally:
+            self._lock.release()
+        for pool in pools.itervalues():
+            for conn in pool:
+                conn.close()
+
+    def request(self, url, headers=None, stream=False):
+        """ GET ``url`` and return a TransportResponse.
+
+            With ``stream=True`` the body is a file-like object read from the
+            socket on demand; the connection returns to the pool once it has
+            been read to the end.
+        """
+        for redirect in xrange(self.max_redirects + 1):
+            response = self._request(url, headers, stream)
+            location = response.headers.get('location')
+            if response.status not in self.redirect_statuses or not location:
+                break
+            if stream:
+                response.body.close()
+            url = urlparse.urljoin(url, location)
+        return response
+
+    def _request(self, url, headers, stream):
+        scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+        if query:
+            path = '%s?%s' % (path, query)
+        proxy = self._proxy(scheme, netloc)
+        key = (scheme, netloc, proxy)
+        headers = dict(headers or {})
+        if self.compress:
+            headers.setdefault('Accept-Encoding', 'gzip, deflate')
+        if proxy is not None and scheme != 'https':
+            # a plain http proxy is sent the absolute URL
+            path = urlparse.urlunsplit((scheme, netloc, path or '/', '', ''))
+            if proxy[1]:
+                headers['Proxy-Authorization'] = proxy[1]
+        while True:
+            conn, reused = self._acquire(key)
+            try:
+                conn.request('GET', path or '/', headers=headers)
+                resp = conn.getresponse()
+                encoded = resp.getheader('content-encoding') in ('gzip',
+                                                                 'deflate')
+                if stream:
+                    body = _PooledStream(self, key, conn, resp,
+                                         _Inflater() if encoded else None)
+                    return TransportResponse(resp.status, resp.reason,
+                                             dict(resp.getheaders()), body)
+                body = resp.read()
+                if encoded:
+                    inflater = _Inflater()
+                    body = inflater.decompress(body) + inflater.flush()
+            except socket.timeout:
+                conn.close()
+                raise
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                # the server may have dropped an idle keep-alive connection,
+                # only give up if a fresh connection fails too
+                if reused:
+                    continue
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return TransportResponse(resp.status, resp.reason,
+                                     dict(resp.getheaders()), body)
+
+class _PooledStream(object):
+    """ Body of a streamed response, releasing its connection when done. """
+
+    def __init__(self, transport, key, conn, resp, inflater=None):
+        self._transport = transport
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self._inflater = inflater
+
+    def read(self, size=-1):
+        while self._conn is not None:
+            data = self._resp.read(None if size < 0 else size)
+            if size < 0 or not data:
+                self._finish(True)
+            if self._inflater is None:
+                return data
+            if data:
+                data = self._inflater.decompress(data)
+            else:
+                data = self._inflater.flush()
+            # a compressed chunk may not yield any output on its own
+            if data or self._conn is None:
+                return data
+        return ''
+
+    def _finish(self, consumed):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if consumed and not self._resp.will_close:
+            self._transport._release(self._key, conn)
+        else:
+            conn.close()
+
+    def close(self):
+        self._finish(False)
+
+def _cache_key(func, params):
+    """ Key identifying a call by function name and normalized params. """
+    items = sorted((k, v.encode('utf-8') if isinstance(v, unicode) else str(v))
+                   for k, v in params.iteritems() if v)
+    return '%s?%s' % (func, urllib.urlencode(items))
+
+class MemoryCache(object):
+    """ In-process response cache holding at most ``maxsize`` entries.
+
+        Entries expire after the TTL they were stored with, and the least
+        recently used entry is evicted once the cache is full.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[1] < time.time():
+                self.misses += 1
+                return None
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, ttl):
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + ttl)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+        finally:
+            self._lock.release()
+
+class SqliteCache(object):
+    """ On-disk response cache that can be shared by several processes.
+
+        ``path`` is the sqlite database file, ``maxsize`` bounds the number of
+        entries with the least recently used ones evicted first.  Hit and miss
+        counters are kept per process.
+
+        So that reads stay reads, a hit only records its access time when the
+        last one is over ``touch_interval`` seconds old, and the size is
+        checked (and the cache pruned) once every ``prune_interval`` sets of
+        a process rather than on each, so it may briefly exceed ``maxsize``.
+    """
+
+    touch_interval = 60
+    prune_interval = 256
+
+    def __init__(self, path, maxsize=100000, timeout=30):
+        self.path = path
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._sets = 0
+        self._local = threading.local()
+        self._conn().execute('CREATE TABLE IF NOT EXISTS cache '
+                             '(key TEXT PRIMARY KEY, value TEXT, '
+                             'expires REAL, accessed REAL)')
+        self._conn().execute('CREATE INDEX IF NOT EXISTS cache_accessed '
+                             'ON cache (accessed)')
+
+    def _conn(self):
+        # sqlite connections may not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.text_factory = str
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute('SELECT value, accessed FROM cache '
+                           'WHERE key=? AND expires>=?', (key, now)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        if now - row[1] > self.touch_interval:
+            conn.execute('UPDATE cache SET accessed=? WHERE key=?', (now, key))
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                     (key, value, now + ttl, now))
+        self._sets += 1
+        if self._sets < min(self.prune_interval, self.maxsize):
+            return
+        self._sets = 0
+        count = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self.maxsize:
+            conn.execute('DELETE FROM cache WHERE expires<?', (now,))
+            conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                         'ORDER BY accessed LIMIT ?)', (count - self.maxsize,))
+
+    def clear(self):
+        self._conn().execute('DELETE FROM cache')
+
+class Histogram(object):
+    """ Counts of observed durations (in seconds) per latency bucket. """
+
+    bounds = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5,
+              10, float('inf'))
+
+    def __init__(self):
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        i = 0
+        while seconds > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, q):
+        """ Upper bound of the bucket holding the ``q`` (0-1) percentile. """
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+
+class EndpointStats(object):
+    """ Counters and latency histograms of a single API function.
+
+        ``network``, ``decode`` and ``construct`` time fetching the response,
+        decoding its JSON and building result objects.  ``cache_hits``
+        counts calls answered locally (ZipIndex, Mirror or cache) and
+        ``cache_misses`` calls that went to the API.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.network = Histogram()
+        self.decode = Histogram()
+        self.construct = Histogram()
+
+    @property
+    def cache_ratio(self):
+        total = self.cache_hits + self.cache_misses
+        return float(self.cache_hits) / total if total else None
+
+class Metrics(object):
+    """ Per API function call counts, errors, bytes and timings.
+
+        Assign to ``votesmart.metrics`` to start collecting.  Callables in
+        ``before_request`` are called with ``(func, params)`` before every
+        request to the API, those in ``after_request`` with ``(func, params,
+        info)`` after it, ``info`` being a dict of ``seconds``, ``bytes`` and
+        ``error`` (None on success).
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self.before_request = []
+        self.after_request = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __getitem__(self, func):
+        self._lock.acquire()
+        try:
+            stats = self.endpoints.get(func)
+            if stats is None:
+                stats = self.endpoints[func] = EndpointStats()
+            return stats
+        finally:
+            self._lock.release()
+
+    def _spent(self, seconds):
+        self._local.spent = getattr(self._local, 'spent', 0.0) + seconds
+
+    def _served(self, func, fetched):
+        self._local.func = func
+        stats = self[func]
+        self._lock.acquire()
+        try:
+            stats.calls += 1
+            if fetched:
+                stats.cache_misses += 1
+            else:
+                stats.cache_hits += 1
+        finally:
+            self._lock.release()
+
+    def _fetch(self, func, params, headers, request):
+        for hook in self.before_request:
+            hook(func, params)
+        stats = self[func]
+        start = time.time()
+        error = None
+        size = 0
+        try:
+            response = request(func, params, headers=headers)
+            size = len(response.body)
+            return response
+        except Exception, error:
+            raise
+        finally:
+            seconds = time.time() - start
+            self._spent(seconds)
+            self._lock.acquire()
+            try:
+                stats.network.observe(seconds)
+                stats.bytes += size
+                if error is not None:
+                    stats.errors += 1
+            finally:
+                self._lock.release()
+            info = {'seconds': seconds, 'bytes': size, 'error': error}
+            for hook in self.after_request:
+                hook(func, params, info)
+
+    def _decode(self, func, body):
+        stats = self[func]
+        start = time.time()
+        try:
+            return _decode_response(body)
+        except VotesmartApiError:
+            self._lock.acquire()
+            try:
+                stats.errors += 1
+            finally:
+                self._lock.release()
+            raise
+        finally:
+            seconds = time.time() - start
+            self._spent(seconds)
+            self._lock.acquire()
+            try:
+                stats.decode.observe(seconds)
+            finally:
+                self._lock.release()
+
+    def _observe_call(self, fn, args, kwargs):
+        local = self._local
+        outer = (getattr(local, 'func', None), getattr(local, 'spent', 0.0))
+        local.func = None
+        local.spent = 0.0
+        start = time.time()
+        try:
+            result = fn(*args, **kwargs)
+            func = local.func
+            if func is not None:
+                seconds = time.time() - start - local.spent
+                stats = self[func]
+                self._lock.acquire()
+                try:
+                    stats.construct.observe(max(seconds, 0))
+                finally:
+                    self._lock.release()
+            return result
+        finally:
+            local.func, local.spent = outer
+
+    def snapshot(self):
+        """ Plain dict of the collected statistics, e.g. for exporting. """
+        self._lock.acquire()
+        try:
+            return dict((func, {
+                'calls': s.calls, 'errors': s.errors, 'bytes': s.bytes,
+                'cache_hits': s.cache_hits, 'cache_misses': s.cache_misses,
+                'network': dict(count=s.network.count, sum=s.network.sum,
+                                buckets=list(s.network.counts)),
+                'decode': dict(count=s.decode.count, sum=s.decode.sum,
+                               buckets=list(s.decode.counts)),
+                'construct': dict(count=s.construct.count,
+                                  sum=s.construct.sum,
+                                  buckets=list(s.construct.counts)),
+            }) for func, s in self.endpoints.iteritems())
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.endpoints = {}
+        finally:
+            self._lock.release()
+
+class _Unchanged(Exception):
+    """ Raised inside an API method whose response hasn't changed. """
+
+    def __init__(self, result):
+        Exception.__init__(self)
+        self.result = result
+
+class _MemoEntry(object):
+    __slots__ = ('etag', 'last_modified', 'digest', 'result')
+
+    def __init__(self, etag, last_modified, digest, result=None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.result = result
+
+    def conditions(self):
+        """ Headers making a request conditional on the stored validators. """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers or None
+
+class ResultMemo(object):
+    """ Reuses the result of an API method while its response is unchanged.
+
+        Assigned to ``votesmart.memo`` it remembers, per call, the ETag and
+        Last-Modified headers and a hash of the response along with the
+        object the method returned.  Repeated calls are made conditional on
+        the headers, and a 304 or an identical body returns the remembered
+        object without decoding the JSON or building any objects.  Results
+        are shared between calls, so treat them as read-only.  At most
+        ``maxsize`` calls are remembered, least recently used first out.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.reused = 0
+        self.rebuilt = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _call(self, run, args, kwargs):
+        local = self._local
+        outer = getattr(local, 'call', None)
+        call = local.call = {}
+        try:
+            try:
+                result = run(*args, **kwargs)
+            except _Unchanged, e:
+                self._count('reused')
+                return e.result
+            pending = call.get('pending')
+            if pending is not None:
+                pending.result = result
+                self._store(call['key'], pending)
+                self._count('rebuilt')
+            return result
+        finally:
+            local.call = outer
+
+    def _count(self, counter):
+        self._lock.acquire()
+        try:
+            setattr(self, counter, getattr(self, counter) + 1)
+        finally:
+            self._lock.release()
+
+    def _begin(self, key):
+        """ The call in progress and the entry for ``key``, if memoizable. """
+        call = getattr(self._local, 'call', None)
+        if call is None:
+            return None, None
+        if 'key' in call:
+            # methods making several requests aren't remembered
+            call['pending'] = None
+            return None, None
+        call['key'] = key
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = self._entries.pop(key)
+            return call, entry
+        finally:
+            self._lock.release()
+
+    def _check(self, call, entry, body, status, headers):
+        if status == 304 and entry is not None:
+            raise _Unchanged(entry.result)
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        digest = hashlib.sha1(body).digest()
+        if entry is not None and entry.digest == digest:
+            raise _Unchanged(entry.result)
+        headers = headers or {}
+        call['pending'] = _MemoEntry(headers.get('etag'),
+                                     headers.get('last-modified'), digest)
+
+    def _store(self, key, entry):
+        self._lock.acquire()
+        try:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+        finally:
+            self._lock.release()
+
+class Future(object):
+    """ Pending result of a call submitted to a WorkerPool. """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _finish(self, result=None, exc_info=None):
+        self._lock.acquire()
+        try:
+            self._result = result
+            self._exc_info = exc_info
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._lock.release()
+        for fn in callbacks:
+            fn(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Wait for the call and return its result or raise its error. """
+        if not self._done.wait(timeout):
+            raise VotesmartApiError('Timed out waiting for result')
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise VotesmartApiError('Timed out waiting for result')
+        return self._exc_info and self._exc_info[1]
+
+    def add_done_callback(self, fn):
+        """ Call ``fn(future)`` once the result is available. """
+        self._lock.acquire()
+        try:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        finally:
+            self._lock.release()
+        fn(self)
+
+class SingleFlight(object):
+    """ Coalesces concurrent calls with the same key into a single call.
+
+        The first caller for a key runs it, callers arriving while it is in
+        flight wait for and share its result.  ``calls`` counts calls that
+        were run and ``coalesced`` those that were saved.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        self._lock.acquire()
+        try:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                self.calls += 1
+                future = self._flights[key] = Future()
+            else:
+                self.coalesced += 1
+        finally:
+            self._lock.release()
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args)
+        except Exception:
+            exc_info = sys.exc_info()
+            self._land(key, future, exc_info=exc_info)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        self._land(key, future, result)
+        return result
+
+    def _land(self, key, future, result=None, exc_info=None):
+        self._lock.acquire()
+        try:
+            del self._flights[key]
+        finally:
+            self._lock.release()
+        future._finish(result, exc_info)
+
+class WorkerPool(object):
+    """ Runs submitted calls on at most ``workers`` threads. """
+
+    def __init__(self, workers=8):
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                future._finish(exc_info=sys.exc_info())
+            else:
+                future._finish(result)
+
+    def submit(self, fn, *args, **kwargs):
+        """ Schedule ``fn(*args, **kwargs)`` and return its Future. """
+        self._lock.acquire()
+        try:
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        self._lock.acquire()
+        try:
+            threads, self._threads = self._threads, []
+        finally:
+            self._lock.release()
+        for thread in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+class RateLimiter(object):
+    """ Token bucket allowing ``rate`` calls per second in bursts of up to
+        ``burst`` calls, shared by all threads using it.
+
+        When ``lockfile`` is given the bucket state lives in that file, so
+        every process using the same file shares a single budget.
+    """
+
+    def __init__(self, rate, burst=None, lockfile=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.lockfile = lockfile
+        self._tokens = self.burst
+        self._stamp = time.time()
+        self._lock = threading.Lock()
+        if lockfile and fcntl is None:
+            raise VotesmartApiError('lockfile requires fcntl support')
+
+    def _take(self, tokens, stamp):
+        now = time.time()
+        tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, now, 0
+        return tokens, now, (1 - tokens) / self.rate
+
+    def _take_shared(self):
+        fd = os.open(self.lockfile, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                state = os.read(fd, 64).split()
+                if len(state) == 2:
+                    tokens, stamp = float(state[0]), float(state[1])
+                else:
+                    tokens, stamp = self.burst, time.time()
+                tokens, stamp, delay = self._take(tokens, stamp)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, '%r %r' % (tokens, stamp))
+                return delay
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def acquire(self):
+        """ Block until a call may be made. """
+        while True:
+            self._lock.acquire()
+            try:
+                if self.lockfile:
+                    delay = self._take_shared()
+                else:
+                    self._tokens, self._stamp, delay = self._take(self._tokens,
+                                                                  self._stamp)
+            finally:
+                self._lock.release()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+class CircuitBreaker(object):
+    """ Fails calls fast once ``threshold`` consecutive calls have failed.
+
+        After ``reset_timeout`` seconds a single trial call is let through,
+        closing the circuit again if it succeeds.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before(self):
+        self._lock.acquire()
+        try:
+            if self.opened_at is None:
+                return
+            if time.time() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError('Circuit open after %d failures'
+                                       % self.failures)
+            # half-open: hold the circuit open for others during the trial
+            self.opened_at = time.time()
+        finally:
+            self._lock.release()
+
+    def success(self):
+        self._lock.acquire()
+        try:
+            self.failures = 0
+            self.opened_at = None
+        finally:
+            self._lock.release()
+
+    def failure(self):
+        self._lock.acquire()
+        try:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
+        finally:
+            self._lock.release()
+
+class BatchResult(object):
+    """ Outcome of a single call made by ``votesmart.batch``. """
+
+    def __init__(self, index, endpoint, args, result=None, error=None):
+        self.index = index
+        self.endpoint = endpoint
+        self.args = args
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
 
     def __repr__(self):
-        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+        return '%s(%r, %r, %r)' % (self.__class__.__name__, self.index,
+                                   self.endpoint, self.args)
+
+class _ModelMeta(type):
+    """ Gives each model class ``__slots__`` for its declared ``_fields``. """
+
+    def __new__(mcs, name, bases, attrs):
+        inherited = set()
+        for base in bases:
+            inherited.update(getattr(base, '_fieldset', ()))
+        fields = tuple(attrs.get('_fields', ()))
+        attrs['__slots__'] = tuple(attrs.get('__slots__', ())) + tuple(
+            f for f in fields if f not in inherited)
+        attrs['_fieldset'] = frozenset(inherited.union(fields))
+        return type.__new__(mcs, name, bases, attrs)
+
+_setattr = object.__setattr__
+
+class VotesmartApiObject(object):
+    """ Base for all result objects.
+
+        Known fields of a model are declared in ``_fields`` and stored in
+        slots, any other keys the API returns are kept in an overflow dict.
+        Both are available as plain attributes.
+    """
+    __metaclass__ = _ModelMeta
+    __slots__ = ('_extra',)
+
+    # name: (endpoint, field) of related records ``expand`` can fetch
+    _relations = {}
+
+    # field naming the record, objects of the same identity are shared
+    # while an IdentityMap is active
+    _identity = None
 
-class Address(object):
     def __init__(self, d):
-        self.__dict__.update(d['address'])
-        self.__dict__.update(d['phone'])
-        self.__dict__.update(d['notes'])
+        self._load(d)
+
+    def _load(self, d, exclude=()):
+        fieldset = self._fieldset
+        extra = None
+        for k, v in d.iteritems():
+            if k in exclude:
+                continue
+            if k in fieldset:
+                _setattr(self, k, v)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[k] = v
+        _setattr(self, '_extra', extra)
+
+    def __getattr__(self, name):
+        if name != '_extra':
+            extra = self._extra
+            if extra and name in extra:
+                return extra[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in self._fieldset:
+            _setattr(self, name, value)
+        else:
+            if self._extra is None:
+                _setattr(self, '_extra', {})
+            self._extra[name] = value
+
+    def _asdict(self):
+        d = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if name != '_extra' and hasattr(self, name):
+                    d[name] = getattr(self, name)
+        if self._extra:
+            d.update(self._extra)
+        return d
+
+    def __getstate__(self):
+        return self._asdict()
+
+    def __setstate__(self, state):
+        _setattr(self, '_extra', None)
+        for k, v in state.iteritems():
+            setattr(self, k, v)
 
     def __repr__(self):
-        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+        return '%s(%r)' % (self.__class__.__name__, self._asdict())
+
+_CANDIDATE_FIELDS = ('candidateId', 'firstName', 'nickName', 'middleName',
+    'preferredName', 'lastName', 'suffix', 'title', 'ballotName',
+    'electionParties', 'electionStatus', 'electionStage',
+    'electionDistrictId', 'electionDistrictName', 'electionOffice',
+    'electionOfficeId', 'electionStateId', 'electionOfficeTypeId',
+    'electionYear', 'electionSpecial', 'electionDate', 'officeParties',
+    'officeStatus', 'officeDistrictId', 'officeDistrictName', 'officeStateId',
+    'officeId', 'officeName', 'officeTypeId', 'runningMateId',
+    'runningMateName')
+
+_CANDIDATE_RELATIONS = {
+    'bio': ('candidatebio.getBio', 'candidateId'),
+    'addl_bio': ('candidatebio.getAddlBio', 'candidateId'),
+    'office_address': ('address.getOffice', 'candidateId'),
+    'office_web_address': ('address.getOfficeWebAddress', 'candidateId'),
+    'campaign_address': ('address.getCampaign', 'candidateId'),
+    'campaign_web_address': ('address.getCampaignWebAddress', 'candidateId'),
+    'ratings': ('rating.getCandidateRating', 'candidateId'),
+    'npat': ('npat.getNpat', 'candidateId'),
+}
+
+class Address(VotesmartApiObject):
+    _fields = ('street', 'city', 'state', 'zip', 'phone1', 'phone2', 'fax1',
+               'fax2', 'tollFree', 'ttyd')
+
+    def __init__(self, d):
+        fields = dict(d['address'])
+        fields.update(d['phone'])
+        fields.update(d['notes'])
+        self._load(fields)
 
 class WebAddress(VotesmartApiObject):
+    _fields = ('webAddressTypeId', 'webAddressType', 'webAddress')
+
     def __str__(self):
         return self.webAddress
 
-class Bio(object):
-    def __init__(self, d):
-        #self.__dict__.update(d['election'])
-        #self.__dict__.update(d['office'])
-        self.__dict__.update(d['candidate'])
+class Bio(VotesmartApiObject):
+    _fields = ('candidateId', 'crpId', 'photo', 'firstName', 'nickName',
+               'middleName', 'preferredName', 'lastName', 'suffix',
+               'birthDate', 'birthPlace', 'pronunciation', 'gender', 'family',
+               'homeCity', 'homeState', 'education', 'profession', 'political',
+               'religion', 'congMembership', 'orgMembership', 'specialMsg')
 
-    def __repr__(self):
-        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+    def __init__(self, d):
+        #self._load(d['election'])
+        #self._load(d['office'])
+        self._load(d['candidate'])
 
 class AddlBio(VotesmartApiObject):
+    _fields = ('name', 'data')
+
     def __str__(self):
         return ': '.join((self.name, self.data))
 
 class Candidate(VotesmartApiObject):
+    _fields = _CANDIDATE_FIELDS
+    _identity = 'candidateId'
+    _relations = _CANDIDATE_RELATIONS
+
     def __str__(self):
         return ' '.join((self.firstName, self.lastName))
 
 class CommitteeType(VotesmartApiObject):
+    _fields = ('committeeTypeId', 'name')
+
     def __str__(self):
         return self.name
 
 class Committee(VotesmartApiObject):
+    _fields = ('committeeId', 'parentId', 'stateId', 'committeeTypeId', 'name')
+    _identity = 'committeeId'
+    _relations = {'detail': ('committee.getCommittee', 'committeeId'),
+                  'members': ('committee.getCommitteeMembers', 'committeeId')}
+
     def __str__(self):
         return self.name
 
 class CommitteeDetail(VotesmartApiObject):
+    _fields = ('committeeId', 'parentId', 'stateId', 'committeeTypeId',
+               'name', 'jurisdiction', 'contact')
+    _identity = 'committeeId'
+
     def __str__(self):
         return self.name
 
 class CommitteeMember(VotesmartApiObject):
+    _fields = ('candidateId', 'title', 'firstName', 'middleName', 'lastName',
+               'suffix', 'party', 'position')
+    _identity = 'candidateId'
+    _relations = _CANDIDATE_RELATIONS
+
     def __str__(self):
         return ' '.join((self.title, self.firstName, self.lastName))
 
 class District(VotesmartApiObject):
+    _fields = ('districtId', 'name', 'officeId', 'stateId')
+
     def __str__(self):
         return self.name
 
 class Election(VotesmartApiObject):
+    _fields = ('electionId', 'name', 'stateId', 'officeTypeId', 'special',
+               'electionYear', 'stages')
+
     def __init__(self, d):
-        stages = d.pop('stage', None)
-        self.__dict__ = d
+        self._load(d, ('stage',))
+        stages = d.get('stage')
         if stages:
             self.stages = _result_to_obj(ElectionStage, stages)
 
@@ -87,139 +1201,797 @@ class Election(VotesmartApiObject):
         return self.name
 
 class ElectionStage(VotesmartApiObject):
+    _fields = ('stageId', 'name', 'stateId', 'electionElectionstageId',
+               'electionDate', 'filingDeadline', 'npatMailed')
+
     def __str__(self):
         return '%s (%s)' % (self.name, self.electionDate)
 
 class Official(VotesmartApiObject):
+    _fields = _CANDIDATE_FIELDS
+    _identity = 'candidateId'
+    _relations = _CANDIDATE_RELATIONS
+
     def __str__(self):
         return ' '.join((self.title, self.firstName, self.lastName))
 
 class LeadershipPosition(VotesmartApiObject):
+    _fields = ('leadershipId', 'name', 'officeId', 'officeName')
+
     def __str__(self):
         return self.name
 
 class Locality(VotesmartApiObject):
+    _fields = ('localId', 'name', 'url')
+
     def __str__(self):
         return self.name
 
+class NpatRow(VotesmartApiObject):
+    _fields = ('rowText', 'rowType', 'optionText', 'answerText', 'rows')
+
+    def __init__(self, d):
+        self._load(d, ('row',))
+        self.rows = _result_to_obj(NpatRow, d.get('row') or [])
+
+    def __str__(self):
+        return self.rowText
+
+class NpatSection(VotesmartApiObject):
+    _fields = ('name', 'rows')
+
+    def __init__(self, d):
+        self._load(d, ('row',))
+        self.rows = _result_to_obj(NpatRow, d.get('row') or [])
+
+    def __str__(self):
+        return self.name
+
+class Npat(VotesmartApiObject):
+    """ A candidate's Political Courage Test (NPAT).
+
+        Also a read-only mapping of the response's keys, like the dict
+        ``getNpat`` used to return, e.g. ``npat['surveyMessage']``, and
+        ``dict(npat)`` gives a plain dict (for ``json.dumps``).  ``sections``
+        are built from the raw answers on access, ``answers()`` walks them
+        without building objects.
+    """
+    _fields = ('candidateId', 'candidate', 'passed', 'npatName',
+               'electionName', 'electionYear', 'electionDate',
+               'electionStage', 'surveyMessage')
+
+    @property
+    def sections(self):
+        return _result_to_obj(NpatSection, self.get('section') or [])
+
+    def answers(self):
+        """ Yield (section, question, answer) for every answered question,
+            the question being its row text prefixed by that of the rows
+            it is nested in.
+        """
+        for section in _as_list(self.get('section') or []):
+            stack = [((), row) for row in reversed(_as_list(
+                section.get('row') or []))]
+            while stack:
+                path, row = stack.pop()
+                text = row.get('rowText')
+                if text:
+                    path += (text,)
+                children = row.get('row')
+                if children:
+                    stack.extend((path, child) for child in
+                                 reversed(_as_list(children)))
+                    continue
+                answer = row.get('answerText') or row.get('optionText')
+                if answer:
+                    yield section.get('name', ''), ' / '.join(path), answer
+
+    # read-only mapping over the response's keys, as getNpat's dict was
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        if key in self._fieldset:
+            return hasattr(self, key)
+        return bool(self._extra) and key in self._extra
+
+    def __iter__(self):
+        return iter(self._asdict())
+
+    def __len__(self):
+        return len(self._asdict())
+
+    def get(self, key, default=None):
+        if key in self:
+            return getattr(self, key)
+        return default
+
+    def keys(self):
+        return self._asdict().keys()
+
+    def values(self):
+        return self._asdict().values()
+
+    def items(self):
+        return self._asdict().items()
+
+    def iteritems(self):
+        return self._asdict().iteritems()
+
+    def __str__(self):
+        return '%s: %s' % (self.candidateId, self.npatName)
+
+Mapping.register(Npat)
+
 class Measure(VotesmartApiObject):
+    _fields = ('measureId', 'measureCode', 'title', 'outcome')
+    _relations = {'detail': ('measure.getMeasure', 'measureId')}
+
     def __str__(self):
         return self.title
 
 class MeasureDetail(VotesmartApiObject):
+    _fields = ('measureId', 'measureCode', 'title', 'electionDate',
+               'electionType', 'outcome', 'yes', 'no', 'summary', 'summaryUrl',
+               'measureText', 'textUrl', 'proUrl', 'conUrl', 'source')
+
     def __str__(self):
         return self.title
 
 class OfficeType(VotesmartApiObject):
+    _fields = ('officeTypeId', 'officeLevelId', 'officeBranchId', 'name')
+
     def __str__(self):
         return ': '.join((self.officeTypeId, self.name))
 
 class OfficeBranch(VotesmartApiObject):
+    _fields = ('officeBranchId', 'name')
+
     def __str__(self):
         return ': '.join((self.officeBranchId, self.name))
 
 class OfficeLevel(VotesmartApiObject):
+    _fields = ('officeLevelId', 'name')
+
     def __str__(self):
         return ': '.join((self.officeLevelId, self.name))
 
 class Office(VotesmartApiObject):
+    _fields = ('officeId', 'officeTypeId', 'officeLevelId', 'officeBranchId',
+               'name', 'title', 'shortTitle')
+
     def __str__(self):
         return self.name
 
 class Category(VotesmartApiObject):
+    _fields = ('categoryId', 'name')
+
     def __str__(self):
         return ': '.join((self.categoryId, self.name))
 
 class Sig(VotesmartApiObject):
+    _fields = ('sigId', 'parentId', 'name')
+    _relations = {'detail': ('rating.getSig', 'sigId')}
+
     def __str__(self):
         return ': '.join((self.sigId, self.name))
 
 class SigDetail(VotesmartApiObject):
+    _fields = ('sigId', 'parentId', 'stateId', 'name', 'description',
+               'address', 'city', 'state', 'zip', 'phone1', 'phone2', 'fax',
+               'email', 'url', 'contactName')
+
     def __str__(self):
         return self.name
 
 class Rating(VotesmartApiObject):
+    _fields = ('sigId', 'ratingId', 'categories', 'timeSpan', 'rating',
+               'ratingName', 'ratingText')
+    _relations = {'sig': ('rating.getSig', 'sigId')}
+
     def __str__(self):
         return self.ratingText
 
 class State(VotesmartApiObject):
+    _fields = ('stateId', 'name')
+
     def __str__(self):
         return ' '.join((self.stateId, self.name))
 
 class StateDetail(VotesmartApiObject):
+    _fields = ('stateId', 'stateType', 'name', 'nickName', 'capital', 'area',
+               'population', 'statehood', 'motto', 'flower', 'tree', 'bird',
+               'highPoint', 'lowPoint', 'bicameral', 'upperLegis',
+               'lowerLegis', 'ltGov', 'senators', 'reps', 'termLimit',
+               'termLength', 'billUrl', 'voteUrl', 'voterReg', 'primaryDate',
+               'generalDate', 'absenteeWho', 'absenteeHow', 'absenteeWhen',
+               'largestCity', 'rollCall', 'usCircuit')
+
     def __str__(self):
         return ' '.join((self.stateId, self.name))
 
 class BillSponsor(VotesmartApiObject):
+    _fields = ('candidateId', 'name', 'type')
+    _relations = _CANDIDATE_RELATIONS
+
     def __str__(self):
         return self.name
 
 class BillAction(VotesmartApiObject):
+    _fields = ('actionId', 'level', 'stage', 'outcome', 'statusDate', 'yea',
+               'nay', 'voice')
+    _identity = 'actionId'
+    _relations = {'detail': ('votes.getBillAction', 'actionId'),
+                  'votes': ('votes.getBillActionVotes', 'actionId')}
+
     def __str__(self):
         return ' - '.join((self.statusDate, self.stage))
 
 class BillAmendment(VotesmartApiObject):
+    _fields = ('amendmentId', 'title', 'statusDate', 'actionId')
+
     def __str__(self):
         return self.title
 
 class BillDetail(VotesmartApiObject):
+    _fields = ('billId', 'billNumber', 'parentBillId', 'type', 'title',
+               'officialTitle', 'billTextUrl', 'dateIntroduced', 'stateId',
+               'sponsors', 'actions', 'amendments')
+
     def __init__(self, d):
-        sponsors = d.pop('sponsors')
-        actions = d.pop('actions')
-        amendments = d.pop('amendments')  # ammendments -- sic
-        if not sponsors: sponsors = { 'sponsor': [] } 
+        self._load(d, ('sponsors', 'actions', 'amendments'))
+        sponsors = d['sponsors']
+        actions = d['actions']
+        amendments = d['amendments']  # ammendments -- sic
+        if not sponsors: sponsors = { 'sponsor': [] }
         self.sponsors = _result_to_obj(BillSponsor, sponsors['sponsor'])
         self.actions = _result_to_obj(BillAction, actions['action'])
         if amendments:
             self.amendments = _result_to_obj(BillAmendment, amendments['amendment'])
-        self.__dict__.update(d)
 
 class BillActionDetail(VotesmartApiObject):
+    _fields = ('actionId', 'billNumber', 'officialTitle', 'highlight',
+               'synopsis', 'rollNumber', 'stage', 'level', 'outcome',
+               'statusDate', 'yea', 'nay', 'voice')
+    _identity = 'actionId'
+
     def __str__(self):
         return self.officialTitle
 
 class Bill(VotesmartApiObject):
+    _fields = ('billId', 'billNumber', 'title', 'type', 'categoryId',
+               'categories', 'actionId', 'stage', 'vote', 'yea', 'nay',
+               'officeId', 'statusDate')
+    _identity = 'billId'
+    _relations = {'detail': ('votes.getBill', 'billId'),
+                  'action': ('votes.getBillAction', 'actionId'),
+                  'votes': ('votes.getBillActionVotes', 'actionId')}
+
     def __str__(self):
         return ' '.join((self.billNumber, self.title))
 
 class Vote(VotesmartApiObject):
+    _fields = ('candidateId', 'candidateName', 'officeParties', 'action')
+    _relations = _CANDIDATE_RELATIONS
+
     def __str__(self):
         return ': '.join((self.candidateName, self.action))
 
 class Veto(VotesmartApiObject):
+    _fields = ('vetoId', 'billNumber', 'billTitle', 'vetoType', 'vetoCode',
+               'vetoDate')
+
     def __str__(self):
         return ' '.join((self.billNumber, self.billTitle))
 
+_decoder = json.JSONDecoder()
+_delimiters = frozenset(',]} \t\r\n')
+
+class _JsonReader(object):
+    """ Decodes consecutive JSON values from a stream, one at a time. """
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """ Next non-whitespace character, '' at the end of the stream. """
+        while True:
+            buf, pos = self.buf, self.pos
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            self.pos = pos
+            if pos < len(buf) or not self._fill():
+                return buf[pos:pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise VotesmartApiError('Invalid Response')
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+                # a number is only complete once followed by a delimiter
+                if self.eof or self.buf[end:end + 1] in _delimiters:
+                    self.pos = end
+                    return obj
+            except ValueError:
+                if self.eof:
+                    raise VotesmartApiError('Invalid Response')
+            self._fill()
+
+def _iter_json_items(stream, path, chunk_size=65536):
+    """ Yield the items of the list found under the keys ``path`` in the
+        JSON object read from ``stream``, without decoding it as a whole.
+    """
+    reader = _JsonReader(stream, chunk_size)
+    for depth, key in enumerate(path):
+        reader.expect('{')
+        while True:
+            if reader.peek() != '"':
+                raise VotesmartApiError('Invalid Response')
+            name = reader.value()
+            reader.expect(':')
+            if name == key:
+                break
+            value = reader.value()
+            if depth == 0 and name == 'error':
+                raise VotesmartApiError(value['errorMessage'])
+            if reader.peek() == ',':
+                reader.expect(',')
+    if reader.peek() != '[':
+        # a single item is returned on its own rather than in a list
+        item = reader.value()
+        if item:
+            yield item
+        return
+    reader.expect('[')
+    if reader.peek() == ']':
+        return
+    while True:
+        item = reader.value()
+        # the if item predicate is important, see _result_to_obj
+        if item:
+            yield item
+        char = reader.peek()
+        reader.expect(char)
+        if char == ']':
+            return
+
+# JSON decoders ``votesmart.decoder`` can name, 'fastest' being the first
+# available of orjson, simplejson, ujson and the standard library (see
+# ``python bench_votesmart.py decode``)
+decoders = {'json': json.loads}
+if simplejson is not None:
+    decoders['simplejson'] = simplejson.loads
+if ujson is not None:
+    decoders['ujson'] = ujson.loads
+if orjson is not None:
+    decoders['orjson'] = orjson.loads
+decoders['fastest'] = [decoders[name] for name in
+                       ('orjson', 'simplejson', 'ujson', 'json')
+                       if name in decoders][0]
+
+def _decode_response(body):
+    loads = decoders.get(votesmart.decoder)
+    if loads is None:
+        raise VotesmartApiError('JSON decoder %r is not available'
+                                % votesmart.decoder)
+    try:
+        obj = loads(body)
+    except ValueError, e:
+        raise VotesmartApiError('Invalid Response')
+    if 'error' in obj:
+        raise VotesmartResponseError(obj['error']['errorMessage'])
+    return obj
+
+# fields with few distinct values, or repeated across many results
+_INTERNED_FIELDS = frozenset(('candidateId', 'candidateName', 'title',
+    'firstName', 'lastName', 'suffix', 'party', 'officeParties',
+    'electionParties', 'action', 'stateId', 'officeStateId',
+    'electionStateId', 'officeId', 'officeName', 'officeTypeId',
+    'officeStatus', 'officeDistrictId', 'officeDistrictName', 'electionOffice',
+    'electionOfficeId', 'electionOfficeTypeId', 'electionStatus',
+    'electionStage', 'electionDistrictId', 'electionDistrictName',
+    'electionYear', 'position', 'committeeTypeId', 'stage', 'level',
+    'outcome', 'type', 'statusDate'))
+
+class IdentityMap(object):
+    """ Shares result objects and repeated strings between results.
+
+        Assigned to ``votesmart.identities``, results of models with an
+        ``_identity`` field (candidates, officials, committees, bills and
+        actions) are looked up by that id, and the existing object returned
+        when the API sent exactly the same fields and values for it.  Values of fields that
+        repeat across results (parties, states, offices, vote actions, ids,
+        ...) are stored once.  ``clear`` forgets everything, e.g. between
+        sessions of a long-running process.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._objects = {}
+        self._strings = {}
+        self._interned = {}
+        # results are built from batch and async worker threads too
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def _fields(self, cls):
+        fields = self._interned.get(cls)
+        if fields is None:
+            fields = self._interned[cls] = tuple(
+                f for f in cls._fieldset if f in _INTERNED_FIELDS)
+        return fields
+
+    def get(self, cls, d):
+        """ The object for the decoded item ``d``, shared if already seen. """
+        key = None
+        if cls._identity is not None:
+            ident = d.get(cls._identity)
+            if ident:
+                key = (cls, ident)
+                obj = self._objects.get(key)
+                # a row with fewer fields than the object isn't the same
+                if obj is not None and obj._asdict() == d:
+                    self._lock.acquire()
+                    try:
+                        self.hits += 1
+                    finally:
+                        self._lock.release()
+                    return obj
+        obj = cls(d)
+        fields = self._fields(cls)
+        self._lock.acquire()
+        try:
+            strings = self._strings
+            for field in fields:
+                value = getattr(obj, field, None)
+                if isinstance(value, basestring):
+                    _setattr(obj, field, strings.setdefault(value, value))
+            if key is not None:
+                self.misses += 1
+                self._objects[key] = obj
+        finally:
+            self._lock.release()
+        return obj
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._objects.clear()
+            self._strings.clear()
+        finally:
+            self._lock.release()
+
+class LazyResultList(Sequence):
+    """ List of results that builds each object on first access.
+
+        Used in place of a list when ``votesmart.lazy`` is set, the decoded
+        JSON is kept as is until an item is indexed or iterated over.
+    """
+
+    def __init__(self, cls, items):
+        self._cls = cls
+        self._items = items
+        self._objs = [None] * len(items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        obj = self._objs[index]
+        if obj is None:
+            identities = votesmart.identities
+            if identities is None:
+                obj = self._cls(self._items[index])
+            else:
+                obj = identities.get(self._cls, self._items[index])
+            self._objs[index] = obj
+        return obj
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __repr__(self):
+        return repr(list(self))
+
 def _result_to_obj(cls, result):
     if isinstance(result, dict):
-        return [cls(result)]
-    else:
-        # the if o predicate is important, sometimes they return empty strings
-        return [cls(o) for o in result if o]
+        result = [result]
+    # the if o predicate is important, sometimes they return empty strings
+    if votesmart.lazy:
+        return LazyResultList(cls, [o for o in result if o])
+    identities = votesmart.identities
+    if identities is not None:
+        return [identities.get(cls, o) for o in result if o]
+    return [cls(o) for o in result if o]
 
 class votesmart(object):
 
     apikey = None
+    # point at a Sidecar to share its cache and rate limit between processes
+    base_url = os.environ.get('VOTESMART_BASE_URL',
+                              'http://api.votesmart.org/')
+
+    # return LazyResultList instead of building every object up front
+    lazy = False
+    transport = HttpTransport()
+
+    # response cache (MemoryCache, SqliteCache or compatible) and the number
+    # of seconds responses of each function may be served from it
+    cache = None
+    cache_default_ttl = 0
+    cache_ttls = {
+        'State.getStateIDs': 86400,
+        'Office.getTypes': 86400,
+        'Office.getBranches': 86400,
+        'Office.getLevels': 86400,
+        'Committee.getTypes': 86400,
+        'Rating.getCategories': 86400,
+    }
+
+    # local Mirror and ZipIndex answering calls before the cache and network
+    mirror = None
+    zipindex = None
+
+    # Cassette recording every call, or replaying recorded calls offline
+    cassette = None
+
+    # NameIndex answering the by-name candidate and official lookups
+    nameindex = None
+
+    # Metrics collecting per-function timings and counts, off when None
+    metrics = None
+
+    # ResultMemo reusing the objects built for responses that haven't changed
+    memo = None
+
+    # IdentityMap sharing objects and repeated strings between results
+    identities = None
+
+    # name of the JSON decoder in ``decoders`` used for whole responses
+    decoder = 'json'
+
+    # SingleFlight sharing one upstream fetch among identical concurrent calls
+    singleflight = SingleFlight()
+
+    # shared RateLimiter and CircuitBreaker guarding every call, if any
+    rate_limiter = None
+    circuit_breaker = None
+
+    # transient failures are retried with exponential backoff and jitter
+    max_retries = 2
+    retry_backoff = 0.5
+    retry_backoff_max = 30
+    retry_statuses = (429, 500, 502, 503, 504)
 
     @staticmethod
-    def _apicall(func, params):
-        if votesmart.apikey is None:
+    def _retry_delay(attempt, response=None):
+        retry_after = response and response.headers.get('retry-after')
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), votesmart.retry_backoff_max)
+        return random.uniform(0, min(votesmart.retry_backoff * 2 ** attempt,
+                                     votesmart.retry_backoff_max))
+
+    @staticmethod
+    def _fetch(func, params):
+        return votesmart._fetch_response(func, params).body
+
+    @staticmethod
+    def _fetch_response(func, params, headers=None):
+        if votesmart.metrics is not None:
+            return votesmart.metrics._fetch(func, params, headers,
+                                            votesmart._request)
+        return votesmart._request(func, params, headers=headers)
+
+    @staticmethod
+    def _request(func, params, stream=False, headers=None, via=None):
+        # ``via`` (a Sidecar) supplies the base_url, apikey, transport,
+        # rate_limiter and circuit_breaker otherwise taken from votesmart
+        if via is None:
+            via = votesmart
+        if via.apikey is None:
             raise VotesmartApiError('Missing Project Vote Smart apikey')
 
+        base_url = via.base_url
+        if not base_url.endswith('/'):
+            base_url += '/'
+        url = '%s%s?o=JSON&key=%s&%s' % (base_url, func,
+            via.apikey, urllib.urlencode(params))
+        breaker = via.circuit_breaker
+        attempt = 0
+        while True:
+            if breaker:
+                breaker.before()
+            if via.rate_limiter:
+                via.rate_limiter.acquire()
+            response = None
+            try:
+                if stream:
+                    response = via.transport.request(url, stream=True)
+                elif headers:
+                    response = via.transport.request(url, headers)
+                else:
+                    response = via.transport.request(url)
+            except (httplib.HTTPException, socket.error), e:
+                error = VotesmartApiError(e)
+                retryable = True
+            else:
+                # 304 answers a conditional request made with ``headers``
+                if response.status == 200 or (headers and
+                                              response.status == 304):
+                    if breaker:
+                        breaker.success()
+                    return response
+                if stream:
+                    response.body.close()
+                error = VotesmartHttpError(response.status, response.reason)
+                retryable = response.status in votesmart.retry_statuses
+            if breaker:
+                if retryable:
+                    breaker.failure()
+                else:
+                    breaker.success()
+            if not retryable or attempt >= votesmart.max_retries:
+                raise error
+            time.sleep(votesmart._retry_delay(attempt, response))
+            attempt += 1
+
+    @staticmethod
+    def _apicall(func, params):
+        params = dict([(k,v) for (k,v) in params.iteritems() if v])
+        key = _cache_key(func, params)
+        memo = votesmart.memo
+        call = entry = None
+        if memo is not None:
+            call, entry = memo._begin(key)
+        cassette = votesmart.cassette
+        body = None
+        for source in (cassette, votesmart.zipindex, votesmart.mirror):
+            if source is not None:
+                body = source.lookup(func, params)
+                if body is not None:
+                    break
+
+        fetched = ttl = False
+        headers = None
+        if body is None:
+            cache = votesmart.cache
+            ttl = cache is not None and votesmart.cache_ttls.get(
+                func, votesmart.cache_default_ttl)
+            if ttl:
+                # responses are cached undecoded so any backend can store them
+                body = cache.get(key)
+            if body is None:
+                fetched = True
+                if votesmart.metrics is not None:
+                    # counted up front so failed calls count too
+                    votesmart.metrics._served(func, fetched)
+                if entry is not None:
+                    headers = entry.conditions()
+                if votesmart.singleflight is None:
+                    response = votesmart._fetch_response(func, params, headers)
+                else:
+                    # only callers sending the same conditions may share a 304
+                    flight = key
+                    if headers:
+                        flight = '%s\n%r' % (key, sorted(headers.items()))
+                    response = votesmart.singleflight.do(
+                        flight, votesmart._fetch_response, func, params,
+                        headers)
+                body = response.body
+                headers = response.headers
+
+        metrics = votesmart.metrics
+        if metrics is not None and not fetched:
+            metrics._served(func, fetched)
+        if call is not None:
+            # raises _Unchanged for a 304 or a body identical to the last one
+            try:
+                memo._check(call, entry, body, fetched and response.status,
+                            headers)
+            except _Unchanged:
+                # an identical body decoded fine last time, so cache it again
+                if fetched and ttl and response.status == 200:
+                    cache.set(key, body, ttl)
+                raise
+        if cassette is not None:
+            cassette.record(func, params, body)
+
+        if metrics is None:
+            obj = _decode_response(body)
+        else:
+            obj = metrics._decode(func, body)
+        if fetched and ttl:
+            cache.set(key, body, ttl)
+        return obj
+
+    @staticmethod
+    def _apistream(func, params, path, chunk_size=65536):
+        """ Yield the items under ``path`` of a response as they arrive. """
         params = dict([(k,v) for (k,v) in params.iteritems() if v])
-        url = 'http://api.votesmart.org/%s?o=JSON&key=%s&%s' % (func,
-            votesmart.apikey, urllib.urlencode(params))
+        cassette = votesmart.cassette
+        body = None
+        for source in (cassette, votesmart.mirror):
+            if source is not None:
+                body = source.lookup(func, params)
+                if body is not None:
+                    break
+        if body is None and cassette is not None:
+            # recording needs the whole body, so this call isn't streamed
+            body = votesmart._fetch(func, params)
+            cassette.record(func, params, body)
+        if body is not None:
+            body = StringIO.StringIO(body)
+        else:
+            body = votesmart._request(func, params, stream=True).body
         try:
-            response = urllib2.urlopen(url).read()
-            obj = json.loads(response)
-            if 'error' in obj:
-                raise VotesmartApiError(obj['error']['errorMessage'])
-            else:
-                return obj
-        except urllib2.HTTPError, e:
-            raise VotesmartApiError(e)
-        except ValueError, e:
-            raise VotesmartApiError('Invalid Response')
+            for item in _iter_json_items(body, path, chunk_size):
+                yield item
+        finally:
+            body.close()
+
+    @staticmethod
+    def iter_items(func, params, path, chunk_size=65536):
+        """ Stream the decoded items under ``path`` of any API function
+            without building objects, e.g. ``iter_items(
+            'Votes.getBillActionVotes', {'actionId': 23069}, ('votes', 'vote'))``.
+        """
+        return votesmart._apistream(func, params, path, chunk_size)
+
+    @staticmethod
+    def batch(calls, endpoint=None, workers=8, rate=None, stream=False):
+        """ Run many calls concurrently on a pool of ``workers`` threads.
+
+            ``calls`` is a list of ``(endpoint, args)`` pairs, or when
+            ``endpoint`` is given, a list of args for that endpoint.  An
+            endpoint is a name such as ``'candidatebio.getBio'`` or a
+            ``votesmart`` method, args a dict of keyword arguments, a tuple of
+            positional arguments or a single value such as an id.  ``rate``
+            caps the number of calls started per second.
+
+            Returns a list of BatchResult in input order, errors are captured
+            on each result rather than raised.  With ``stream=True`` a
+            generator yields results as they complete instead.
+        """
+        if endpoint is not None:
+            calls = [(endpoint, args) for args in calls]
+        results = _run_batch(list(calls), workers, rate)
+        if stream:
+            return results
+        return sorted(results, key=lambda r: r.index)
 
     class address(object):
         @staticmethod
@@ -287,15 +2059,23 @@ class votesmart(object):
 
         @staticmethod
         def getByLastname(lastName, electionYear=None):
+            found = _names_lookup(Candidate, lastName, 0, electionYear)
+            if found:
+                return found
             params = {'lastName': lastName, 'electionYear':electionYear}
             result = votesmart._apicall('Candidates.getByLastname', params)
-            return _result_to_obj(Candidate, result['candidateList']['candidate'])
+            objs = _result_to_obj(Candidate, result['candidateList']['candidate'])
+            return _names_learn(objs)
 
         @staticmethod
         def getByLevenstein(lastName, electionYear=None):
+            found = _names_lookup(Candidate, lastName, None, electionYear)
+            if found:
+                return found
             params = {'lastName': lastName, 'electionYear':electionYear}
             result = votesmart._apicall('Candidates.getByLevenstein', params)
-            return _result_to_obj(Candidate, result['candidateList']['candidate'])
+            objs = _result_to_obj(Candidate, result['candidateList']['candidate'])
+            return _names_learn(objs)
 
         @staticmethod
         def getByElection(electionId):
@@ -406,6 +2186,20 @@ class votesmart(object):
             result = votesmart._apicall('Local.getCities', params)
             return _result_to_obj(Locality, result['cities']['city'])
 
+        @staticmethod
+        def iter_getCounties(stateId):
+            params = {'stateId': stateId}
+            items = votesmart._apistream('Local.getCounties', params,
+                                         ('counties', 'county'))
+            return (Locality(o) for o in items)
+
+        @staticmethod
+        def iter_getCities(stateId):
+            params = {'stateId': stateId}
+            items = votesmart._apistream('Local.getCities', params,
+                                         ('cities', 'city'))
+            return (Locality(o) for o in items)
+
         @staticmethod
         def getOfficials(localId):
             params = {'localId': localId}
@@ -430,7 +2224,7 @@ class votesmart(object):
         def getNpat(candidateId):
             params = {'candidateId':candidateId}
             result = votesmart._apicall('Npat.getNpat', params)
-            return result['npat']
+            return Npat(result['npat'])
 
     class office(object):
         @staticmethod
@@ -487,15 +2281,23 @@ class votesmart(object):
 
         @staticmethod
         def getByLastname(lastName):
+            found = _names_lookup(Official, lastName, 0)
+            if found:
+                return found
             params = {'lastName':lastName}
             result = votesmart._apicall('Officials.getByLastname', params)
-            return _result_to_obj(Official, result['candidateList']['candidate'])
+            objs = _result_to_obj(Official, result['candidateList']['candidate'])
+            return _names_learn(objs)
 
         @staticmethod
         def getByLevenstein(lastName):
+            found = _names_lookup(Official, lastName, None)
+            if found:
+                return found
             params = {'lastName':lastName}
             result = votesmart._apicall('Officials.getByLevenstein', params)
-            return _result_to_obj(Official, result['candidateList']['candidate'])
+            objs = _result_to_obj(Official, result['candidateList']['candidate'])
+            return _names_learn(objs)
 
         @staticmethod
         def getByElection(electionId):
@@ -577,6 +2379,13 @@ class votesmart(object):
             result = votesmart._apicall('Votes.getBillActionVotes', params)
             return _result_to_obj(Vote, result['votes']['vote'])
 
+        @staticmethod
+        def iter_getBillActionVotes(actionId):
+            params = {'actionId':actionId}
+            items = votesmart._apistream('Votes.getBillActionVotes', params,
+                                         ('votes', 'vote'))
+            return (Vote(o) for o in items)
+
         @staticmethod
         def getBillActionVoteByOfficial(actionId, candidateId):
             params = {'actionId':actionId, 'candidateId':candidateId}
@@ -601,6 +2410,13 @@ class votesmart(object):
             result = votesmart._apicall('Votes.getBillsByYearState', params)
             return _result_to_obj(Bill, result['bills']['bill'])
 
+        @staticmethod
+        def iter_getBillsByYearState(year, stateId=None):
+            params = {'year':year, 'stateId':stateId}
+            items = votesmart._apistream('Votes.getBillsByYearState', params,
+                                         ('bills', 'bill'))
+            return (Bill(o) for o in items)
+
         @staticmethod
         def getBillsByOfficialYearOffice(candidateId, year, officeId=None):
             params = {'candidateId':candidateId, 'year':year, 'officeId':officeId}
@@ -642,3 +2458,1660 @@ class votesmart(object):
             params = {'candidateId': candidateId}
             result = votesmart._apicall('Votes.getVetoes', params)
             return _result_to_obj(Veto, result['vetoes']['veto'])
+
+
+def _resolve_endpoint(endpoint):
+    if callable(endpoint):
+        return endpoint
+    namespace, name = endpoint.split('.')
+    return getattr(getattr(votesmart, namespace), name)
+
+def _run_batch(calls, workers, rate):
+    pool = WorkerPool(workers)
+    limiter = rate and RateLimiter(rate, burst=1)
+    done = Queue.Queue()
+
+    def run(index, endpoint, args):
+        result = BatchResult(index, endpoint, args)
+        try:
+            if limiter:
+                limiter.acquire()
+            fn = _resolve_endpoint(endpoint)
+            if isinstance(args, dict):
+                result.result = fn(**args)
+            elif isinstance(args, tuple):
+                result.result = fn(*args)
+            else:
+                result.result = fn(args)
+        except Exception, e:
+            result.error = e
+        done.put(result)
+
+    try:
+        for index, (endpoint, args) in enumerate(calls):
+            pool.submit(run, index, endpoint, args)
+        for i in xrange(len(calls)):
+            yield done.get()
+    finally:
+        pool.shutdown(wait=False)
+
+def _namespaces():
+    """ (name, class) for each API namespace of the votesmart client. """
+    for name, ns in sorted(vars(votesmart).iteritems()):
+        if isinstance(ns, type) and not name.startswith('_'):
+            yield name, ns
+
+def _model_objects(value):
+    if isinstance(value, VotesmartApiObject):
+        return [value]
+    if isinstance(value, (list, tuple, LazyResultList)):
+        return [o for o in value if isinstance(o, VotesmartApiObject)]
+    return []
+
+def expand(objs, paths, workers=8):
+    """ Fetch related records of result objects and attach them.
+
+        ``paths`` names relations declared in the models' ``_relations``
+        (e.g. ``'office_address'`` or ``'ratings'`` of an Official) or
+        attributes holding nested objects, dotted to go deeper, e.g.
+        ``'detail.actions.votes'`` for a list of Bill objects.  Each level's
+        calls are deduplicated and run concurrently on ``workers`` threads;
+        a related record the API answers with an error message (no data) is
+        set to None, while other failures (HTTP errors, connection errors,
+        an open circuit breaker) are raised.
+
+        Every API method also accepts ``expand=paths`` to do this on its
+        result.
+    """
+    if isinstance(paths, basestring):
+        paths = [paths]
+    tree = {}
+    for path in paths:
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, {})
+    _expand_level(_model_objects(objs), tree, workers)
+    return objs
+
+def _expand_level(objs, tree, workers):
+    if not objs:
+        return
+    pending = OrderedDict()
+    for name in tree:
+        known = False
+        for obj in objs:
+            relation = obj._relations.get(name)
+            if relation is None:
+                known = known or name in obj._fieldset or bool(
+                    obj._extra and name in obj._extra)
+                continue
+            known = True
+            endpoint, field = relation
+            value = getattr(obj, field, None)
+            if value:
+                pending.setdefault((endpoint, value), []).append((obj, name))
+            else:
+                setattr(obj, name, None)
+        if not known:
+            raise ValueError('nothing to expand named %r' % name)
+
+    calls = list(pending)
+    for result in votesmart.batch(calls, workers=workers):
+        if result.error is not None and not isinstance(result.error,
+                                                       VotesmartResponseError):
+            raise result.error
+        for obj, name in pending[calls[result.index]]:
+            setattr(obj, name, result.result)
+
+    for name, subtree in tree.iteritems():
+        if subtree:
+            children = []
+            for obj in objs:
+                children.extend(_model_objects(getattr(obj, name, None)))
+            _expand_level(children, subtree, workers)
+
+def _instrumented(fn):
+    def run(*args, **kwargs):
+        metrics = votesmart.metrics
+        if metrics is None:
+            return fn(*args, **kwargs)
+        return metrics._observe_call(fn, args, kwargs)
+    def call(*args, **kwargs):
+        paths = kwargs.pop('expand', None)
+        memo = votesmart.memo
+        if memo is None:
+            result = run(*args, **kwargs)
+        else:
+            result = memo._call(run, args, kwargs)
+        if paths:
+            expand(result, paths)
+        return result
+    call.__name__ = fn.__name__
+    call.__doc__ = fn.__doc__
+    return call
+
+def _instrument_namespaces():
+    """ Let Metrics and ResultMemo see every API method call, and give
+        each method an ``expand`` argument. """
+    for name, ns in _namespaces():
+        for attr, method in vars(ns).items():
+            if isinstance(method, staticmethod) and not attr.startswith('iter_'):
+                setattr(ns, attr, staticmethod(_instrumented(getattr(ns, attr))))
+
+_instrument_namespaces()
+
+class _AsyncNamespace(object):
+    def __init__(self, pool, ns):
+        for name, method in vars(ns).iteritems():
+            # streaming iter_ methods are lazy already
+            if isinstance(method, staticmethod) and not name.startswith('iter_'):
+                setattr(self, name, self._submitter(pool, getattr(ns, name)))
+
+    @staticmethod
+    def _submitter(pool, fn):
+        def submit(*args, **kwargs):
+            return pool.submit(fn, *args, **kwargs)
+        submit.__name__ = fn.__name__
+        return submit
+
+class AsyncVotesmart(object):
+    """ Non-blocking client mirroring the ``votesmart`` namespaces.
+
+        Every method takes the same arguments as its ``votesmart`` counterpart
+        and returns a Future.  At most ``concurrency`` calls are in flight at
+        once, the rest wait in a queue.
+
+            client = AsyncVotesmart(concurrency=16)
+            futures = [client.candidatebio.getBio(c) for c in candidateIds]
+            bios = client.gather(futures)
+    """
+
+    def __init__(self, concurrency=16):
+        self.pool = WorkerPool(concurrency)
+        for name, ns in _namespaces():
+            setattr(self, name, _AsyncNamespace(self.pool, ns))
+
+    @staticmethod
+    def gather(futures, timeout=None):
+        """ Wait for all ``futures`` and return their results in order. """
+        return [f.result(timeout) for f in futures]
+
+    def close(self, wait=True):
+        self.pool.shutdown(wait)
+
+
+log = logging.getLogger('votesmart')
+log.addHandler(logging.NullHandler())
+
+def _as_list(result):
+    if isinstance(result, dict):
+        return [result]
+    return [o for o in result if o]
+
+def _dig(obj, *path):
+    """ The list of items under ``path`` in a decoded response. """
+    for key in path:
+        if not isinstance(obj, dict) or key not in obj:
+            return []
+        obj = obj[key]
+    return _as_list(obj)
+
+class Mirror(object):
+    """ Local SQLite copy of API responses.
+
+        Assign a mirror to ``votesmart.mirror`` and every call it holds a
+        response for is answered from disk.  With ``offline=True`` calls
+        missing from the mirror raise VotesmartApiError instead of going to
+        the network.  Responses are indexed by the candidateId, stateId,
+        officeId and billId they were requested for.
+    """
+
+    indexed = ('candidateId', 'stateId', 'officeId', 'billId')
+
+    def __init__(self, path, offline=False, timeout=30):
+        self.path = path
+        self.offline = offline
+        self.timeout = timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS responses '
+                     '(key TEXT PRIMARY KEY, func TEXT, params TEXT, '
+                     'body TEXT, fetched_at REAL, %s)'
+                     % ', '.join('%s TEXT' % c for c in self.indexed))
+        for column in ('func', 'fetched_at') + self.indexed:
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_%s '
+                         'ON responses (%s)' % (column, column))
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.text_factory = str
+            self._local.conn = conn
+        return conn
+
+    def _stored(self, func, params):
+        row = self._conn().execute('SELECT body FROM responses WHERE key=?',
+                                   (_cache_key(func, params),)).fetchone()
+        return row and row[0]
+
+    def lookup(self, func, params):
+        """ Stored response body for a call, None if there is none. """
+        body = self._stored(func, params)
+        if body is not None:
+            return body
+        if self.offline:
+            raise VotesmartApiError('%s not in mirror'
+                                    % _cache_key(func, params))
+        return None
+
+    def store(self, func, params, body):
+        """ Store a response body, returning whether it is new or changed. """
+        params = dict([(k, v.decode('utf-8') if isinstance(v, str)
+                        else unicode(v)) for (k,v) in params.iteritems() if v])
+        key = _cache_key(func, params)
+        conn = self._conn()
+        row = conn.execute('SELECT body FROM responses WHERE key=?',
+                           (key,)).fetchone()
+        if row is not None and row[0] == body:
+            conn.execute('UPDATE responses SET fetched_at=? WHERE key=?',
+                         (time.time(), key))
+            return False
+        conn.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, %s)'
+            % ', '.join('?' * len(self.indexed)),
+            (key, func, json.dumps(params), body,
+             time.time()) + tuple(params.get(c) for c in self.indexed))
+        return True
+
+    def stale(self, max_age, func=None):
+        """ (func, params) of responses fetched more than ``max_age`` seconds
+            ago, oldest first.
+        """
+        sql = 'SELECT func, params FROM responses WHERE fetched_at<?'
+        args = [time.time() - max_age]
+        if func:
+            sql += ' AND func=?'
+            args.append(func)
+        sql += ' ORDER BY fetched_at'
+        return [(f, json.loads(p)) for f, p in self._conn().execute(sql, args)]
+
+    def ids(self, func, column):
+        """ Distinct values of an indexed id over responses of ``func``. """
+        if column not in self.indexed:
+            raise ValueError('%s is not indexed' % column)
+        return set(r[0] for r in self._conn().execute(
+            'SELECT DISTINCT %s FROM responses WHERE func=?' % column, (func,)))
+
+    def find(self, func=None, **ids):
+        """ (func, params) of stored responses, filtered by function name and
+            any of the indexed ids, e.g. ``find(candidateId=26732)``.
+        """
+        where = []
+        args = []
+        if func:
+            where.append('func=?')
+            args.append(func)
+        for column, value in ids.iteritems():
+            if column not in self.indexed:
+                raise ValueError('%s is not indexed' % column)
+            where.append('%s=?' % column)
+            args.append(unicode(value))
+        sql = 'SELECT func, params FROM responses'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        return [(f, json.loads(p)) for f, p in self._conn().execute(sql, args)]
+
+    def fetch(self, func, params):
+        """ Fetch a call from the API, store and return its decoded body.
+
+            Error responses are stored too so they can be replayed offline.
+        """
+        params = dict([(k,v) for (k,v) in params.iteritems() if v])
+        body = votesmart._fetch(func, params)
+        self.store(func, params, body)
+        return _decode_response(body)
+
+    def _try_fetch(self, func, params):
+        try:
+            return self.fetch(func, params)
+        except VotesmartApiError, e:
+            log.info('%s %r: %s', func, params, e)
+            return {}
+
+    def crawl(self, years=(), states=None):
+        """ Walk the reference hierarchy into the mirror.
+
+            Starts from the state list and office types, then fetches the
+            officials of every office in each state (or only ``states``)
+            along with their bios, addresses and ratings, and their bills
+            and bill details for each of ``years``.
+        """
+        fetch = self._try_fetch
+        all_states = [s['stateId'] for s in
+                      _dig(fetch('State.getStateIDs', {}),
+                           'stateList', 'list', 'state')]
+        types = [t['officeTypeId'] for t in
+                 _dig(fetch('Office.getTypes', {}), 'officeTypes', 'type')]
+        for func in ('Office.getBranches', 'Office.getLevels',
+                     'Committee.getTypes'):
+            fetch(func, {})
+        offices = set()
+        for typeId in types:
+            for office in _dig(fetch('Office.getOfficesByType',
+                                     {'officeTypeId': typeId}),
+                               'offices', 'office'):
+                offices.add(office['officeId'])
+
+        candidates = set()
+        for stateId in states or all_states:
+            fetch('State.getState', {'stateId': stateId})
+            fetch('Rating.getCategories', {'stateId': stateId})
+            for officeId in sorted(offices):
+                result = fetch('Officials.getByOfficeState',
+                               {'officeId': officeId, 'stateId': stateId})
+                for c in _dig(result, 'candidateList', 'candidate'):
+                    candidates.add(c['candidateId'])
+
+        bills = set()
+        for candidateId in sorted(candidates):
+            params = {'candidateId': candidateId}
+            for func in ('CandidateBio.getBio', 'CandidateBio.getAddlBio',
+                         'Address.getOffice', 'Address.getOfficeWebAddress',
+                         'Rating.getCandidateRating'):
+                fetch(func, params)
+            for year in years:
+                result = fetch('Votes.getBillsByOfficial',
+                               {'candidateId': candidateId, 'year': year})
+                for bill in _dig(result, 'bills', 'bill'):
+                    bills.add(bill['billId'])
+
+        for billId in sorted(bills):
+            fetch('Votes.getBill', {'billId': billId})
+
+    def refresh(self, years=(), states=None, recent=100, max_age=None):
+        """ Bring the mirror up to date, fetching only what changed.
+
+            The recent-activity and by-year listings of bills, elections and
+            measures are fetched for each state (default: all states in the
+            mirror) and year.  Bills, elections and measures that are new,
+            and bills with recent activity, are then fetched in detail.  With
+            ``max_age`` any other response older than that many seconds is
+            fetched again too.
+
+            Returns a dict counting ``fetched`` and ``changed`` responses.
+        """
+        counts = {'fetched': 0, 'changed': 0}
+        seen = set()
+
+        def fetch(func, params):
+            key = _cache_key(func, params)
+            if key in seen:
+                return {}
+            seen.add(key)
+            counts['fetched'] += 1
+            params = dict([(k,v) for (k,v) in params.iteritems() if v])
+            try:
+                body = votesmart._fetch(func, params)
+            except VotesmartApiError, e:
+                log.info('%s %r: %s', func, params, e)
+                return {}
+            if self.store(func, params, body):
+                counts['changed'] += 1
+            try:
+                return _decode_response(body)
+            except VotesmartApiError:
+                return {}
+
+        if states is None:
+            states = sorted(self.ids('State.getState', 'stateId'))
+        known_bills = self.ids('Votes.getBill', 'billId')
+        new_bills = set()
+        for stateId in states:
+            result = fetch('Votes.getBillsByStateRecent',
+                           {'stateId': stateId, 'amount': recent})
+            # recent activity means a known bill may have changed
+            new_bills.update(b['billId'] for b in _dig(result, 'bills', 'bill'))
+            for year in years:
+                params = {'year': year, 'stateId': stateId}
+                result = fetch('Votes.getBillsByYearState', params)
+                new_bills.update(b['billId'] for b in
+                                 _dig(result, 'bills', 'bill')
+                                 if b['billId'] not in known_bills)
+                result = fetch('Election.getElectionByYearState', params)
+                for election in _dig(result, 'elections', 'election'):
+                    detail = {'electionId': election['electionId']}
+                    if self._stored('Election.getElection', detail) is None:
+                        fetch('Election.getElection', detail)
+                result = fetch('Measure.getMeasuresByYearState', params)
+                for measure in _dig(result, 'measures', 'measure'):
+                    detail = {'measureId': measure['measureId']}
+                    if self._stored('Measure.getMeasure', detail) is None:
+                        fetch('Measure.getMeasure', detail)
+        for billId in sorted(new_bills):
+            fetch('Votes.getBill', {'billId': billId})
+        if max_age is not None:
+            for func, params in self.stale(max_age):
+                fetch(func, params)
+        return counts
+
+class Crawler(object):
+    """ Resumable, concurrent crawl of the API into a Mirror.
+
+        The walk of ``Mirror.crawl`` (states and offices, officials, their
+        bios, addresses and ratings, their bills and the votes on them) is
+        broken into units of one API call kept in a SQLite work queue at
+        ``path``.  Workers lease the highest priority pending unit, store the
+        response in the mirror, then in one transaction mark it done and
+        queue the calls it leads to.  Each call is queued once.
+
+        Stopping or crashing loses at most the units in flight: units leased
+        longer than ``lease_timeout`` seconds ago are handed out again (an
+        expired lease counting as a failed attempt), so ``run`` (or
+        ``work``) simply resumes.  Any number of processes, on
+        one machine or several sharing the queue and mirror files, may work
+        the same queue; together they keep at most ``concurrency`` calls in
+        flight.  Calls failing with transport or HTTP errors are retried up
+        to ``max_attempts`` times.
+
+            crawler = Crawler(Mirror('mirror.db'), 'crawl.db', concurrency=16)
+            crawler.seed(years=[2007, 2008])
+            crawler.run(processes=4, threads=4)
+    """
+
+    # units with a higher priority are handed out first, others get 0
+    priorities = {
+        'State.getState': 90, 'Rating.getCategories': 90,
+        'Officials.getByOfficeState': 80,
+        'CandidateBio.getBio': 60, 'CandidateBio.getAddlBio': 50,
+        'Address.getOffice': 50, 'Address.getOfficeWebAddress': 50,
+        'Rating.getCandidateRating': 40, 'Votes.getBillsByOfficial': 30,
+        'Votes.getBill': 20, 'Votes.getBillActionVotes': 10,
+    }
+    poll_interval = 0.5
+
+    def __init__(self, mirror, path, concurrency=8, lease_timeout=300,
+                 max_attempts=3, timeout=30):
+        self.mirror = mirror
+        self.path = path
+        self.concurrency = concurrency
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.priorities = dict(self.priorities)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS units '
+                     '(key TEXT PRIMARY KEY, func TEXT, params TEXT, '
+                     'priority INTEGER, state TEXT, attempts INTEGER, '
+                     'leased_at REAL, error TEXT)')
+        conn.execute('CREATE INDEX IF NOT EXISTS units_state '
+                     'ON units (state, priority)')
+        conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                     '(name TEXT PRIMARY KEY, value TEXT)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.text_factory = str
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, name, default=None):
+        row = self._conn().execute('SELECT value FROM meta WHERE name=?',
+                                   (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _enqueue(self, conn, units):
+        conn.executemany(
+            "INSERT OR IGNORE INTO units VALUES (?, ?, ?, ?, 'pending', 0, "
+            "NULL, NULL)",
+            [(_cache_key(func, params), func, json.dumps(params),
+              self.priorities.get(func, 0)) for func, params in units])
+
+    def seed(self, years=(), states=None):
+        """ Fetch the state list and offices, and queue the crawl of the
+            officials of each state (or only ``states``) and, for each of
+            ``years``, their bills.
+        """
+        fetch = self.mirror._try_fetch
+        all_states = [s['stateId'] for s in
+                      _dig(fetch('State.getStateIDs', {}),
+                           'stateList', 'list', 'state')]
+        for func in ('Office.getBranches', 'Office.getLevels',
+                     'Committee.getTypes'):
+            fetch(func, {})
+        offices = set()
+        for t in _dig(fetch('Office.getTypes', {}), 'officeTypes', 'type'):
+            result = fetch('Office.getOfficesByType',
+                           {'officeTypeId': t['officeTypeId']})
+            offices.update(o['officeId'] for o in
+                           _dig(result, 'offices', 'office'))
+
+        units = []
+        for stateId in states or all_states:
+            units.append(('State.getState', {'stateId': stateId}))
+            units.append(('Rating.getCategories', {'stateId': stateId}))
+            for officeId in sorted(offices):
+                units.append(('Officials.getByOfficeState',
+                              {'officeId': officeId, 'stateId': stateId}))
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                         ('years', json.dumps(list(years))))
+            self._enqueue(conn, units)
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _expand(self, func, params, result, years):
+        """ The calls a unit's decoded response leads to. """
+        units = []
+        if func == 'Officials.getByOfficeState':
+            for c in _dig(result, 'candidateList', 'candidate'):
+                candidate = {'candidateId': c['candidateId']}
+                for child in ('CandidateBio.getBio', 'CandidateBio.getAddlBio',
+                              'Address.getOffice',
+                              'Address.getOfficeWebAddress',
+                              'Rating.getCandidateRating'):
+                    units.append((child, candidate))
+                for year in years:
+                    units.append(('Votes.getBillsByOfficial',
+                                  dict(candidate, year=year)))
+        elif func == 'Votes.getBillsByOfficial':
+            for bill in _dig(result, 'bills', 'bill'):
+                units.append(('Votes.getBill', {'billId': bill['billId']}))
+        elif func == 'Votes.getBill':
+            for action in _dig(result, 'bill', 'actions', 'action'):
+                units.append(('Votes.getBillActionVotes',
+                              {'actionId': action['actionId']}))
+        return units
+
+    def _lease(self):
+        """ Claim the next pending unit, None if there is none to claim. """
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # an expired lease counts as a failed attempt, so a unit that
+            # keeps crashing or hanging its worker ends up failed
+            conn.execute("UPDATE units SET attempts=attempts+1, "
+                         "error='lease expired', state=CASE "
+                         "WHEN attempts+1>=? THEN 'failed' ELSE 'pending' END "
+                         "WHERE state='running' AND leased_at<?",
+                         (self.max_attempts, now - self.lease_timeout))
+            running, = conn.execute("SELECT COUNT(*) FROM units "
+                                    "WHERE state='running'").fetchone()
+            row = None
+            if running < self.concurrency:
+                row = conn.execute("SELECT key, func, params FROM units "
+                                   "WHERE state='pending' "
+                                   "ORDER BY priority DESC LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute("UPDATE units SET state='running', leased_at=? "
+                             "WHERE key=?", (now, row[0]))
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return row
+
+    def _complete(self, key, units):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._enqueue(conn, units)
+            conn.execute("UPDATE units SET state='done', error=NULL "
+                         "WHERE key=?", (key,))
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _fail(self, key, error):
+        self._conn().execute(
+            "UPDATE units SET attempts=attempts+1, error=?, "
+            "state=CASE WHEN attempts+1>=? THEN 'failed' ELSE 'pending' END "
+            "WHERE key=?", (unicode(error), self.max_attempts, key))
+
+    def progress(self):
+        """ Number of units per state: pending, running, done and failed. """
+        counts = dict.fromkeys(('pending', 'running', 'done', 'failed'), 0)
+        counts.update(self._conn().execute(
+            'SELECT state, COUNT(*) FROM units GROUP BY state'))
+        return counts
+
+    def _work(self):
+        years = self._meta('years', [])
+        while True:
+            unit = self._lease()
+            if unit is None:
+                counts = self.progress()
+                if not counts['pending'] and not counts['running']:
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            key, func, params = unit
+            params = json.loads(params)
+            try:
+                body = votesmart._fetch(func, params)
+            except Exception, e:
+                log.info('%s %r: %s', func, params, e)
+                self._fail(key, e)
+                continue
+            # error responses are stored too, like Mirror.fetch does
+            self.mirror.store(func, params, body)
+            try:
+                result = _decode_response(body)
+            except VotesmartApiError:
+                result = {}
+            self._complete(key, self._expand(func, params, result, years))
+
+    def work(self, threads=4):
+        """ Work the queue from this process until it is drained. """
+        workers = [threading.Thread(target=self._work) for i in range(threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return self.progress()
+
+    def run(self, processes=1, threads=4):
+        """ Work the queue from ``processes`` processes of ``threads``
+            threads each until it is drained, returning ``progress()``.
+        """
+        if processes <= 1:
+            return self.work(threads)
+        mirror = self.mirror
+        children = [multiprocessing.Process(target=_crawl_worker, args=(
+            mirror.path, mirror.offline, mirror.timeout, self.path,
+            self.concurrency, self.lease_timeout, self.max_attempts,
+            self.timeout, self.priorities, self.poll_interval, threads))
+            for i in range(processes)]
+        for child in children:
+            child.start()
+        for child in children:
+            child.join()
+        return self.progress()
+
+def _crawl_worker(mirror_path, offline, mirror_timeout, path, concurrency,
+                  lease_timeout, max_attempts, timeout, priorities,
+                  poll_interval, threads):
+    # pooled connections inherited from the parent must not be shared
+    if isinstance(votesmart.transport, HttpTransport):
+        votesmart.transport._pools = {}
+    mirror = Mirror(mirror_path, offline, mirror_timeout)
+    crawler = Crawler(mirror, path, concurrency, lease_timeout, max_attempts,
+                      timeout)
+    crawler.priorities = priorities
+    crawler.poll_interval = poll_interval
+    crawler.work(threads)
+
+# API error payloads, which are passed on but not cached
+_ERROR_BODY = re.compile(r'\s*\{\s*"error"\s*:')
+
+class _SidecarHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        func = path.strip('/')
+        try:
+            # o and key are the client's, the sidecar uses its own key
+            params = dict((k, v[-1].decode('utf-8')) for k, v in
+                          urlparse.parse_qs(query).iteritems()
+                          if k not in ('o', 'key'))
+        except UnicodeDecodeError:
+            return self._respond(400, 'parameters must be UTF-8')
+        if not func:
+            return self._respond(404, 'no API function given')
+        try:
+            body = self.server.sidecar._serve(func, params)
+        except VotesmartHttpError, e:
+            return self._respond(e.status, str(e))
+        except VotesmartApiError, e:
+            return self._respond(502, str(e))
+        self._respond(200, body=body)
+
+    def _respond(self, status, message=None, body=None):
+        if body is None:
+            body = json.dumps({'error': {'errorMessage': message}})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug('sidecar: ' + format, *args)
+
+class _SidecarServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class Sidecar(object):
+    """ Local caching proxy sharing one upstream budget between processes.
+
+        Serves the API's ``/<function>?o=JSON&...`` interface on ``host``
+        and ``port``, so pointing ``votesmart.base_url`` (or
+        ``$VOTESMART_BASE_URL``) of every process on a host at ``url`` makes
+        them share its cache, pooled upstream connections, ``rate`` limit
+        and single flight of identical calls.  Calls are made upstream with
+        the sidecar's ``apikey``, the clients' keys are ignored.
+
+        Responses are cached for ``cache_ttls[function]`` seconds, or
+        ``ttl`` for functions not listed, in a MemoryCache unless another
+        ``cache`` (e.g. a SqliteCache) is given.  API error payloads are
+        not cached, upstream HTTP errors are passed on with their status
+        and other failures answered with 502.
+
+            sidecar = Sidecar(apikey=KEY, rate=10)
+            sidecar.serve_forever()
+    """
+
+    def __init__(self, host='127.0.0.1', port=8642, apikey=None,
+                 base_url='http://api.votesmart.org/', cache=None, ttl=300,
+                 rate=None, pool_size=16, timeout=30):
+        self.apikey = apikey if apikey is not None else votesmart.apikey
+        self.base_url = base_url
+        self.transport = HttpTransport(pool_size, timeout)
+        self.cache = cache if cache is not None else MemoryCache(10000)
+        self.cache_default_ttl = ttl
+        self.cache_ttls = dict(votesmart.cache_ttls)
+        self.rate_limiter = rate and RateLimiter(rate) or None
+        self.circuit_breaker = None
+        self.singleflight = SingleFlight()
+        self._server = _SidecarServer((host, port), _SidecarHandler)
+        self._server.sidecar = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%s/' % (host, port)
+
+    def _serve(self, func, params):
+        key = _cache_key(func, params)
+        ttl = self.cache_ttls.get(func, self.cache_default_ttl)
+        if ttl:
+            body = self.cache.get(key)
+            if body is not None:
+                return body
+        body = self.singleflight.do(key, self._fetch, func, params)
+        if ttl and not _ERROR_BODY.match(body):
+            self.cache.set(key, body, ttl)
+        return body
+
+    def _fetch(self, func, params):
+        params = dict((k, v.encode('utf-8')) for k, v in params.iteritems())
+        return votesmart._request(func, params, via=self).body
+
+    def serve_forever(self):
+        log.info('sidecar for %s listening on %s', self.base_url, self.url)
+        self._server.serve_forever()
+
+    def start(self):
+        """ Serve from a background thread, returning the sidecar. """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        self.transport.close()
+
+class ZipIndex(object):
+    """ Compact, memory-mapped answers to the by-ZIP lookups.
+
+        ``ZipIndex.build`` fetches ``district.getByZip``, ``officials.getByZip``,
+        ``candidates.getByZip`` and ``election.getElectionByZip`` once for each
+        ZIP code and writes the responses to a single file, compressed and
+        with duplicates (e.g. ZIPs in the same district) stored once.
+        Assigned to ``votesmart.zipindex`` it answers those calls from the
+        file, which is only opened and mapped on the first lookup.
+
+        The file holds a header, a sorted table of fixed-width entries (the
+        zip5+zip4 key and an offset per function) searched by bisection,
+        then the length-prefixed zlib-compressed bodies.
+    """
+
+    funcs = ('District.getByZip', 'Officials.getByZip', 'Candidates.getByZip',
+             'Election.getElectionByZip')
+    _magic = 'VSZIPIX1'
+    _header = struct.Struct('<8sI')
+    _entry = struct.Struct('<9s%dI' % len(funcs))
+    _length = struct.Struct('<I')
+    _missing = 0xffffffff
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._lock.acquire()
+        try:
+            if self._map is None:
+                f = open(self.path, 'rb')
+                try:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                finally:
+                    f.close()
+                magic, count = self._header.unpack_from(data)
+                if magic != self._magic:
+                    raise VotesmartApiError('%s is not a ZipIndex' % self.path)
+                self._count = count
+                self._data_start = (self._header.size +
+                                    count * self._entry.size)
+                self._map = data
+        finally:
+            self._lock.release()
+        return self._map
+
+    def _key(self, i):
+        offset = self._header.size + i * self._entry.size
+        return self._map[offset:offset + 9]
+
+    def _find(self, key):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._key(lo) == key:
+            return self._entry.unpack_from(self._map, self._header.size +
+                                           lo * self._entry.size)[1:]
+        return None
+
+    def lookup(self, func, params):
+        """ Stored response body for a call, None if there is none. """
+        if func not in self.funcs or set(params) - set(('zip5', 'zip4')):
+            return None
+        data = self._map
+        if data is None:
+            data = self._load()
+        offsets = self._find(self._pack_key(params.get('zip5'),
+                                            params.get('zip4')))
+        if offsets is None:
+            return None
+        offset = offsets[self.funcs.index(func)]
+        if offset == self._missing:
+            return None
+        start = self._data_start + offset
+        length, = self._length.unpack_from(data, start)
+        start += self._length.size
+        return zlib.decompress(data[start:start + length])
+
+    @staticmethod
+    def _pack_key(zip5, zip4=None):
+        return ('%s%-4s' % (str(zip5).zfill(5), zip4 or '')).encode('ascii')
+
+    @classmethod
+    def build(cls, path, zips, workers=8):
+        """ Fetch the by-ZIP lookups for ``zips`` and write them to ``path``.
+
+            ``zips`` holds zip5 strings or (zip5, zip4) pairs.  Lookups that
+            fail are left out and fall back to the API when served.
+        """
+        keys = []
+        for z in zips:
+            zip5, zip4 = z if isinstance(z, tuple) else (z, None)
+            keys.append((cls._pack_key(zip5, zip4), zip5, zip4))
+        keys = sorted(set(keys))
+
+        def fetch(func, zip5, zip4):
+            params = dict([(k,v) for (k,v) in
+                           (('zip5', zip5), ('zip4', zip4)) if v])
+            return votesmart._fetch(func, params)
+
+        pool = WorkerPool(workers)
+        try:
+            futures = [[pool.submit(fetch, func, zip5, zip4)
+                        for func in cls.funcs] for key, zip5, zip4 in keys]
+            entries = []
+            blobs = []
+            offsets = {}
+            size = 0
+            for (key, zip5, zip4), row in zip(keys, futures):
+                entry = [key]
+                for future in row:
+                    if future.exception() is not None:
+                        entry.append(cls._missing)
+                        continue
+                    body = future.result()
+                    if body not in offsets:
+                        blob = zlib.compress(body, 9)
+                        offsets[body] = size
+                        blobs.append(cls._length.pack(len(blob)) + blob)
+                        size += len(blobs[-1])
+                    entry.append(offsets[body])
+                entries.append(cls._entry.pack(*entry))
+        finally:
+            pool.shutdown(wait=False)
+
+        tmp = '%s.tmp' % path
+        f = open(tmp, 'wb')
+        try:
+            f.write(cls._header.pack(cls._magic, len(entries)))
+            f.writelines(entries)
+            f.writelines(blobs)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+        return cls(path)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+class Cassette(object):
+    """ Recorded API responses for deterministic offline runs.
+
+        Assigned to ``votesmart.cassette`` in ``'record'`` mode every call
+        goes through as usual and its response is appended to the file at
+        ``path``.  In ``'replay'`` mode calls are answered from the file
+        alone, a call that was never recorded raising VotesmartApiError.
+
+        Each record is a pair of lengths followed by the call's key and its
+        zlib-compressed body.  The file is read into a dict keyed on function
+        and params when opened, so lookups take constant time; bodies are
+        only decompressed when used.
+    """
+
+    _magic = 'VSCASSE1'
+    _lengths = struct.Struct('<II')
+
+    def __init__(self, path, mode='replay'):
+        if mode not in ('record', 'replay'):
+            raise ValueError("mode must be 'record' or 'replay'")
+        self.path = path
+        self.mode = mode
+        self._bodies = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if mode == 'replay' or os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self._bodies)
+
+    def _load(self):
+        f = open(self.path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        if data[:len(self._magic)] != self._magic:
+            raise VotesmartApiError('%s is not a Cassette' % self.path)
+        offset = len(self._magic)
+        size = self._lengths.size
+        while offset + size <= len(data):
+            keylen, bodylen = self._lengths.unpack_from(data, offset)
+            offset += size
+            key = data[offset:offset + keylen]
+            offset += keylen
+            # later records of the same call replace earlier ones
+            self._bodies[key] = data[offset:offset + bodylen]
+            offset += bodylen
+
+    @staticmethod
+    def _key(func, params):
+        return _cache_key(func, params)
+
+    def lookup(self, func, params):
+        """ Recorded response body for a call, None when recording. """
+        if self.mode == 'record':
+            return None
+        key = self._key(func, params)
+        body = self._bodies.get(key)
+        if body is None:
+            raise VotesmartApiError('%s not in cassette' % key)
+        return zlib.decompress(body)
+
+    def items(self):
+        """ (key, body) of every recorded call. """
+        for key, body in self._bodies.items():
+            yield key, zlib.decompress(body)
+
+    def record(self, func, params, body):
+        """ Append a response to the cassette (only in ``'record'`` mode). """
+        if self.mode != 'record':
+            return
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        key = self._key(func, params)
+        data = zlib.compress(body)
+        self._lock.acquire()
+        try:
+            if self._bodies.get(key) == data:
+                return
+            if self._file is None:
+                new = not os.path.exists(self.path)
+                self._file = open(self.path, 'ab')
+                if new:
+                    self._file.write(self._magic)
+            self._file.write(self._lengths.pack(len(key), len(data)))
+            self._file.write(key)
+            self._file.write(data)
+            self._file.flush()
+            self._bodies[key] = data
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        finally:
+            self._lock.release()
+
+def _levenshtein(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = range(len(b) + 1)
+    for i, ca in enumerate(a):
+        current = [i + 1]
+        for j, cb in enumerate(b):
+            current.append(min(previous[j + 1] + 1, current[j] + 1,
+                               previous[j] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+def _deletions(word, depth):
+    """ ``word`` and every string made by deleting up to ``depth`` chars. """
+    found = set([word])
+    frontier = [word]
+    for i in xrange(depth):
+        deeper = []
+        for w in frontier:
+            for j in xrange(len(w)):
+                d = w[:j] + w[j + 1:]
+                if d not in found:
+                    found.add(d)
+                    deeper.append(d)
+        frontier = deeper
+    return found
+
+class NameIndex(object):
+    """ Local index of Candidate and Official objects by last name.
+
+        Assigned to ``votesmart.nameindex`` it answers ``getByLastname`` and
+        ``getByLevenstein`` of ``candidates`` and ``officials`` with the
+        indexed objects, ranked by edit distance, and only calls the API
+        when nothing matches; objects the API returns are then added.  Note
+        a hit returns what is indexed, which may be fewer people than the API
+        knows of by that name.
+
+        Fuzzy matches use a symmetric deletion index: every name is stored
+        under each string obtained by deleting up to ``max_distance``
+        characters from it, so a query only computes the edit distance to
+        names sharing one of its own deletions.
+    """
+
+    def __init__(self, max_distance=2):
+        self.max_distance = max_distance
+        self._objects = {}
+        self._variants = {}
+        # digests of the objects indexed, so identical rows are added once
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(objs) for objs in self._objects.itervalues())
+
+    def add(self, objects):
+        """ Index Candidate and Official objects by their lastName. """
+        self._lock.acquire()
+        try:
+            for obj in objects:
+                name = getattr(obj, 'lastName', None)
+                if not name:
+                    continue
+                name = name.lower()
+                objs = self._objects.setdefault((type(obj), name), [])
+                if not objs:
+                    for variant in _deletions(name, self.max_distance):
+                        self._variants.setdefault(variant, set()).add(name)
+                seen = (type(obj), getattr(obj, 'candidateId', None),
+                        hashlib.sha1(json.dumps(obj._asdict(), sort_keys=True,
+                                                default=unicode)).digest())
+                if seen not in self._seen:
+                    self._seen.add(seen)
+                    objs.append(obj)
+        finally:
+            self._lock.release()
+
+    def _names(self, name, max_distance):
+        if max_distance == 0:
+            return [(0, name)]
+        candidates = set()
+        for variant in _deletions(name, max_distance):
+            candidates.update(self._variants.get(variant, ()))
+        found = []
+        for candidate in candidates:
+            if abs(len(candidate) - len(name)) <= max_distance:
+                d = _levenshtein(name, candidate)
+                if d <= max_distance:
+                    found.append((d, candidate))
+        return sorted(found)
+
+    def search(self, cls, lastName, max_distance=None, electionYear=None):
+        """ Indexed ``cls`` objects whose last name is within
+            ``max_distance`` (at most the index's) edits of ``lastName``,
+            closest first.
+        """
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        self._lock.acquire()
+        try:
+            found = []
+            for d, name in self._names(lastName.lower(), max_distance):
+                for obj in self._objects.get((cls, name), ()):
+                    if (electionYear is None or
+                        getattr(obj, 'electionYear', None) == unicode(electionYear)):
+                        found.append(obj)
+            return found
+        finally:
+            self._lock.release()
+
+    @classmethod
+    def from_mirror(cls, mirror, max_distance=2):
+        """ Index every candidate and official held in a Mirror. """
+        index = cls(max_distance)
+        for func, params in mirror.find():
+            if func.startswith('Candidates.'):
+                model = Candidate
+            elif func.startswith('Officials.'):
+                model = Official
+            else:
+                continue
+            try:
+                result = _decode_response(mirror.lookup(func, params))
+            except VotesmartApiError:
+                continue
+            index.add(model(o) for o in _dig(result, 'candidateList',
+                                            'candidate'))
+        return index
+
+def _names_lookup(cls, lastName, max_distance, electionYear=None):
+    if votesmart.nameindex is None:
+        return None
+    return votesmart.nameindex.search(cls, lastName, max_distance, electionYear)
+
+def _names_learn(objects):
+    if votesmart.nameindex is not None:
+        votesmart.nameindex.add(objects)
+    return objects
+
+class NpatIndex(object):
+    """ Columnar index of NPAT answers across many candidates.
+
+        Each answered question is a row of candidateId, stateId, section,
+        question and answer.  Every column is dictionary encoded: distinct
+        values are stored once and rows hold integer codes, so filters are
+        resolved against the few distinct values and then matched over the
+        code arrays (vectorized when numpy is installed).
+
+        Filters are keyword arguments named after the columns, each a value,
+        a list/set/tuple of values or a predicate called with each distinct
+        value, e.g. ``candidates(stateId='NC', question=lambda q: 'Abortion'
+        in q, answer='Yes')``.
+    """
+
+    columns = ('candidateId', 'stateId', 'section', 'question', 'answer')
+
+    def __init__(self):
+        self.errors = {}
+        self._values = dict((c, []) for c in self.columns)
+        self._codes = dict((c, {}) for c in self.columns)
+        self._data = dict((c, array.array('i')) for c in self.columns)
+        self._indexed = set()
+
+    def __len__(self):
+        return len(self._data['candidateId'])
+
+    def _code(self, column, value):
+        codes = self._codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self._values[column])
+            self._values[column].append(value)
+        return code
+
+    def add(self, npat, stateId=None):
+        """ Index an Npat (once per candidate), returning the rows added. """
+        candidateId = unicode(npat.candidateId)
+        if candidateId in self._indexed:
+            return 0
+        self._indexed.add(candidateId)
+        data = self._data
+        candidate = self._code('candidateId', candidateId)
+        state = self._code('stateId', stateId or '')
+        count = 0
+        for section, question, answer in npat.answers():
+            data['candidateId'].append(candidate)
+            data['stateId'].append(state)
+            data['section'].append(self._code('section', section))
+            data['question'].append(self._code('question', question))
+            data['answer'].append(self._code('answer', answer))
+            count += 1
+        return count
+
+    @classmethod
+    def build(cls, candidates, workers=8, rate=None):
+        """ Fetch and index the NPATs of ``candidates``, candidateIds or
+            Candidate/Official objects.  Only the objects carry a state, so
+            pass those to filter by ``stateId`` (plain ids are indexed with
+            an empty one).  Candidates whose NPAT could not be fetched are
+            kept in ``errors``.
+        """
+        index = cls()
+        ids = []
+        states = []
+        for c in candidates:
+            if isinstance(c, VotesmartApiObject):
+                ids.append(c.candidateId)
+                states.append(getattr(c, 'officeStateId', None) or
+                              getattr(c, 'electionStateId', None))
+            else:
+                ids.append(c)
+                states.append(None)
+        for r in votesmart.batch(ids, 'npat.getNpat', workers=workers,
+                                 rate=rate):
+            if r.ok:
+                index.add(r.result, states[r.index])
+            else:
+                index.errors[ids[r.index]] = r.error
+        return index
+
+    @classmethod
+    def from_mirror(cls, mirror):
+        """ Index every NPAT held in a Mirror, without any network access.
+            Each candidate's state is taken from the candidate and official
+            listings stored in the mirror.
+        """
+        states = {}
+        for func, params in mirror.find():
+            if not func.startswith(('Candidates.', 'Officials.')):
+                continue
+            try:
+                result = _decode_response(mirror.lookup(func, params))
+            except VotesmartApiError:
+                continue
+            for c in _dig(result, 'candidateList', 'candidate'):
+                state = c.get('officeStateId') or c.get('electionStateId')
+                if state:
+                    states.setdefault(unicode(c.get('candidateId')), state)
+        index = cls()
+        for func, params in mirror.find('Npat.getNpat'):
+            try:
+                result = _decode_response(mirror.lookup(func, params))
+            except VotesmartApiError:
+                continue
+            npat = Npat(result['npat'])
+            index.add(npat, states.get(unicode(npat.candidateId)))
+        return index
+
+    def _matching(self, column, value):
+        """ Codes of the distinct values of ``column`` a filter accepts. """
+        if column not in self._codes:
+            raise ValueError('no column %r' % column)
+        codes = self._codes[column]
+        if callable(value):
+            return set(code for v, code in codes.iteritems() if value(v))
+        if not isinstance(value, (list, tuple, set, frozenset)):
+            value = (value,)
+        return set(codes[v] for v in value if v in codes)
+
+    def _selected(self, filters):
+        """ Row numbers passing all ``filters``. """
+        selected = None
+        for column, value in filters.iteritems():
+            codes = self._matching(column, value)
+            data = self._data[column]
+            if numpy is not None:
+                mask = numpy.in1d(numpy.frombuffer(data, dtype=numpy.intc),
+                                  list(codes))
+                rows = numpy.flatnonzero(mask)
+                selected = rows if selected is None else \
+                    numpy.intersect1d(selected, rows, assume_unique=True)
+            else:
+                rows = [i for i, code in enumerate(data) if code in codes]
+                selected = rows if selected is None else \
+                    sorted(set(selected).intersection(rows))
+        if selected is None:
+            return xrange(len(self))
+        return selected
+
+    def rows(self, **filters):
+        """ (candidateId, stateId, section, question, answer) of each row
+            passing the filters.
+        """
+        columns = [(self._values[c], self._data[c]) for c in self.columns]
+        for i in self._selected(filters):
+            yield tuple(values[data[i]] for values, data in columns)
+
+    def candidates(self, **filters):
+        """ Set of candidateIds with a row passing the filters. """
+        values = self._values['candidateId']
+        data = self._data['candidateId']
+        return set(values[data[i]] for i in self._selected(filters))
+
+    def count(self, by, **filters):
+        """ Number of rows passing the filters per distinct value of column
+            ``by``, e.g. ``count('answer', question=q)``.
+        """
+        if by not in self._data:
+            raise ValueError('no column %r' % by)
+        values = self._values[by]
+        data = self._data[by]
+        if numpy is not None:
+            codes = numpy.frombuffer(data, dtype=numpy.intc)
+            if filters:
+                codes = codes[self._selected(filters)]
+            counts = numpy.bincount(codes, minlength=len(values))
+            return dict((values[code], int(n)) for code, n in
+                        enumerate(counts) if n)
+        counts = {}
+        for i in self._selected(filters):
+            value = values[data[i]]
+            counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    def values(self, column, **filters):
+        """ Distinct values of ``column`` among rows passing the filters. """
+        if not filters:
+            if column not in self._values:
+                raise ValueError('no column %r' % column)
+            return list(self._values[column])
+        return self.count(column, **filters).keys()
+
+class VoteMatrix(object):
+    """ Legislator by roll call matrix of votes, backed by NumPy arrays.
+
+        ``votes[i, j]`` holds the code (see ``codes``) of the vote cast by
+        ``candidateIds[i]`` on ``actionIds[j]``, MISSING if there is no
+        record of one.  ``parties[i]`` is the legislator's party as reported
+        with the votes and ``errors`` maps the actionIds whose votes (or with
+        ``from_bills``, the billIds whose actions) could not be fetched to
+        the error.
+    """
+
+    MISSING, YEA, NAY, PRESENT, NOT_VOTING, OTHER, ABSENT = range(7)
+    codes = {'Yea': YEA, 'Nay': NAY, 'Present': PRESENT,
+             'Not Voting': NOT_VOTING, 'Absent': ABSENT}
+
+    def __init__(self, votes, candidateIds, actionIds, parties, errors=None):
+        self.votes = votes
+        self.candidateIds = candidateIds
+        self.actionIds = actionIds
+        self.parties = parties
+        self.errors = errors or {}
+
+    @classmethod
+    def build(cls, actionIds, workers=8, rate=None):
+        """ Fetch the votes on each of ``actionIds`` and assemble them. """
+        if numpy is None:
+            raise ImportError('VoteMatrix requires numpy')
+        actionIds = [unicode(a) for a in actionIds]
+        rows = {}
+        parties = []
+        cells = []
+        errors = {}
+        for r in votesmart.batch(actionIds, 'votes.getBillActionVotes',
+                                 workers=workers, rate=rate):
+            if not r.ok:
+                errors[actionIds[r.index]] = r.error
+                continue
+            for vote in r.result:
+                row = rows.get(vote.candidateId)
+                if row is None:
+                    row = rows[vote.candidateId] = len(rows)
+                    parties.append(getattr(vote, 'officeParties', ''))
+                cells.append((row, r.index,
+                              cls.codes.get(vote.action, cls.OTHER)))
+        votes = numpy.zeros((len(rows), len(actionIds)), dtype=numpy.int8)
+        if cells:
+            cells = numpy.array(cells, dtype=numpy.int32)
+            votes[cells[:, 0], cells[:, 1]] = cells[:, 2]
+        candidateIds = numpy.empty(len(rows), dtype=object)
+        for candidateId, row in rows.iteritems():
+            candidateIds[row] = candidateId
+        return cls(votes, candidateIds, numpy.array(actionIds, dtype=object),
+                   numpy.array(parties, dtype=object), errors)
+
+    @classmethod
+    def from_bills(cls, billIds, workers=8, rate=None):
+        """ Build from every action of each of ``billIds``. """
+        billIds = list(billIds)
+        actionIds = []
+        errors = {}
+        for r in votesmart.batch(billIds, 'votes.getBill', workers=workers,
+                                 rate=rate):
+            if r.ok:
+                actionIds.extend(a.actionId for a in r.result.actions)
+            else:
+                errors[unicode(billIds[r.index])] = r.error
+        matrix = cls.build(actionIds, workers, rate)
+        matrix.errors.update(errors)
+        return matrix
+
+    @classmethod
+    def from_year_state(cls, year, stateId=None, workers=8, rate=None):
+        """ Build from all bills of ``votes.getBillsByYearState``. """
+        bills = votesmart.votes.getBillsByYearState(year, stateId)
+        return cls.from_bills([b.billId for b in bills], workers, rate)
+
+    def party_majorities(self):
+        """ Dict of party to the YEA/NAY majority vote on each roll call,
+            MISSING where the party was evenly split or did not vote.
+        """
+        yea = self.votes == self.YEA
+        nay = self.votes == self.NAY
+        majorities = {}
+        for party in set(self.parties):
+            members = self.parties == party
+            yeas = yea[members].sum(axis=0)
+            nays = nay[members].sum(axis=0)
+            majorities[party] = numpy.where(yeas > nays, self.YEA,
+                numpy.where(nays > yeas, self.NAY,
+                            self.MISSING)).astype(numpy.int8)
+        return majorities
+
+    def party_line_agreement(self):
+        """ Fraction of each legislator's yea/nay votes that went with the
+            majority of their party, NaN for legislators with none.
+        """
+        majorities = self.party_majorities()
+        line = numpy.array([majorities[p] for p in self.parties],
+                           dtype=numpy.int8).reshape(self.votes.shape)
+        voted = ((self.votes == self.YEA) | (self.votes == self.NAY)) & \
+                (line != self.MISSING)
+        agreed = (voted & (self.votes == line)).sum(axis=1)
+        counted = voted.sum(axis=1).astype(float)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return agreed / counted
+
+    def similarity(self):
+        """ Pairwise share of roll calls on which two legislators who both
+            voted yea or nay voted the same way, NaN where they never did.
+        """
+        yea = (self.votes == self.YEA).astype(numpy.float32)
+        nay = (self.votes == self.NAY).astype(numpy.float32)
+        both = yea + nay
+        agreed = yea.dot(yea.T) + nay.dot(nay.T)
+        counted = both.dot(both.T)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return agreed / counted
+
+def model_columns(model):
+    """ The declared fields of a model class, in a stable order. """
+    columns = []
+    for cls in reversed(model.__mro__):
+        for field in cls.__dict__.get('_fields', ()):
+            if field not in columns:
+                columns.append(field)
+    return columns
+
+def _column_value(value):
+    if value is None or isinstance(value, unicode):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return unicode(value)
+
+def column_batches(rows, columns, chunk_size=10000):
+    """ Turn decoded result dicts into dicts of column name to values,
+        ``chunk_size`` rows at a time.  Keys not in ``columns`` are dropped,
+        nested values are JSON encoded and the rest converted to unicode.
+    """
+    batch = dict((c, []) for c in columns)
+    count = 0
+    for row in rows:
+        for c in columns:
+            batch[c].append(_column_value(row.get(c)))
+        count += 1
+        if count == chunk_size:
+            yield batch
+            batch = dict((c, []) for c in columns)
+            count = 0
+    if count:
+        yield batch
+
+def export_columns(rows, path, model, columns=None, format='csv',
+                   chunk_size=10000):
+    """ Write decoded result dicts to ``path`` without building objects.
+
+        The columns are the declared fields of ``model`` (or ``columns``),
+        so every export of a model has the same schema.  ``format`` is
+        ``'csv'``, or with pyarrow installed ``'parquet'`` or ``'arrow'``.
+        Rows are consumed and written ``chunk_size`` at a time, so with a
+        streamed source such as ``votesmart.iter_items`` memory stays
+        bounded.  Returns the number of rows written.
+    """
+    columns = list(columns or model_columns(model))
+    batches = column_batches(rows, columns, chunk_size)
+    written = 0
+    if format == 'csv':
+        f = open(path, 'wb')
+        try:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for batch in batches:
+                values = [batch[c] for c in columns]
+                for row in zip(*values):
+                    writer.writerow([v.encode('utf-8') if v is not None else ''
+                                     for v in row])
+                written += len(values[0])
+        finally:
+            f.close()
+        return written
+
+    if format not in ('parquet', 'arrow'):
+        raise ValueError('unknown format %r' % format)
+    if pyarrow is None:
+        raise ImportError('%s export requires pyarrow' % format)
+    schema = pyarrow.schema([(c, pyarrow.string()) for c in columns])
+    if format == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(path, schema)
+    else:
+        writer = pyarrow.RecordBatchFileWriter(path, schema)
+    try:
+        for batch in batches:
+            arrays = [pyarrow.array(batch[c], type=pyarrow.string())
+                      for c in columns]
+            record_batch = pyarrow.RecordBatch.from_arrays(arrays, columns)
+            if format == 'parquet':
+                writer.write_table(pyarrow.Table.from_batches([record_batch]))
+            else:
+                writer.write_batch(record_batch)
+            written += record_batch.num_rows
+    finally:
+        writer.close()
+    return written
+
+def _main(argv):
+    parser = optparse.OptionParser(
+        usage='%prog mirror|refresh PATH [--year YEAR ...] [--state STATE ...]'
+              '\n       %prog crawl PATH QUEUE [--year YEAR ...] '
+              '[--state STATE ...] [--processes N]'
+              '\n       %prog sidecar [--port PORT] [--rate N] [--cache PATH]')
+    parser.add_option('--apikey', default=os.environ.get('VOTESMART_API_KEY'),
+                      help='API key, defaults to $VOTESMART_API_KEY')
+    parser.add_option('--year', action='append', default=[],
+                      help='fetch bills voted on in YEAR (repeatable)')
+    parser.add_option('--state', action='append', default=[],
+                      help='only crawl officials of STATE (repeatable)')
+    parser.add_option('--max-age', type='float',
+                      help='refresh: also refetch responses older than '
+                           'MAX_AGE seconds')
+    parser.add_option('--processes', type='int', default=1,
+                      help='crawl: worker processes (default 1)')
+    parser.add_option('--threads', type='int', default=4,
+                      help='crawl: threads per process (default 4)')
+    parser.add_option('--concurrency', type='int', default=8,
+                      help='crawl: calls in flight over all workers '
+                           '(default 8)')
+    parser.add_option('--host', default='127.0.0.1',
+                      help='sidecar: address to listen on (default 127.0.0.1)')
+    parser.add_option('--port', type='int', default=8642,
+                      help='sidecar: port to listen on (default 8642)')
+    parser.add_option('--rate', type='float',
+                      help='sidecar: upstream calls per second')
+    parser.add_option('--ttl', type='float', default=300,
+                      help='sidecar: seconds responses are cached '
+                           '(default 300)')
+    parser.add_option('--cache', metavar='PATH',
+                      help='sidecar: cache in a SqliteCache at PATH')
+    options, args = parser.parse_args(argv)
+    if not ((len(args) == 2 and args[0] in ('mirror', 'refresh')) or
+            (len(args) == 3 and args[0] == 'crawl') or args == ['sidecar']):
+        parser.error('expected: mirror|refresh PATH, crawl PATH QUEUE '
+                     'or sidecar')
+    logging.basicConfig(level=logging.INFO)
+    votesmart.apikey = options.apikey
+    if args[0] == 'sidecar':
+        cache = options.cache and SqliteCache(options.cache) or None
+        sidecar = Sidecar(options.host, options.port, cache=cache,
+                          ttl=options.ttl, rate=options.rate)
+        try:
+            sidecar.serve_forever()
+        except KeyboardInterrupt:
+            sidecar.stop()
+        return
+    mirror = Mirror(args[1])
+    if args[0] == 'crawl':
+        crawler = Crawler(mirror, args[2], concurrency=options.concurrency)
+        # an existing queue is resumed rather than seeded again
+        if not sum(crawler.progress().values()):
+            crawler.seed(years=options.year, states=options.state or None)
+        counts = crawler.run(processes=options.processes,
+                             threads=options.threads)
+        log.info('%(done)d units done, %(failed)d failed', counts)
+    elif args[0] == 'mirror':
+        mirror.crawl(years=options.year, states=options.state or None)
+    else:
+        counts = mirror.refresh(years=options.year,
+                                states=options.state or None,
+                                max_age=options.max_age)
+        log.info('fetched %(fetched)d responses, %(changed)d changed', counts)
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv[1:]))